@@ -16,9 +16,13 @@
 """The Cobalt build system command-line interface."""
 
 import argparse
+import distutils.spawn
+import errno
 import fileinput
 import json
 import logging
+import multiprocessing
+import multiprocessing.pool
 import os
 import shutil
 import string
@@ -66,6 +70,12 @@ CONFIG_BINARY_PROTO = os.path.join(OUT_DIR, 'third_party', 'config',
 
 _logger = logging.getLogger()
 _verbose_count = 0
+# The verbosity used for the processes started by the demo commands. Because it
+# makes the demo more interesting we use a verbose_count of at least 3.
+_demo_verbose_count = 3
+# A wait on a multiprocessing result without a timeout can not be interrupted
+# with Ctrl-C in Python 2 so the pools are always waited on with this one.
+_POOL_TIMEOUT_SECS = 7 * 24 * 60 * 60
 
 def _initLogging(verbose_count):
   """Ensures that the logger (obtained via logging.getLogger(), as usual) is
@@ -91,8 +101,29 @@ def ensureDir(dir_path):
     dir_path{string} The path to a directory. If it does not exist it will be
     created.
   """
-  if not os.path.exists(dir_path):
+  # Calling makedirs() unconditionally saves a stat() and tolerates another
+  # process creating the directory concurrently.
+  try:
     os.makedirs(dir_path)
+  except OSError as e:
+    if e.errno != errno.EEXIST or not os.path.isdir(dir_path):
+      raise
+
+def _usable_cpu_count():
+  """Returns the number of CPUs this process is allowed to run on.
+
+  Unlike multiprocessing.cpu_count() this respects the CPU affinity mask, which
+  is what restricts a container started with --cpuset-cpus, taskset, etc.
+  """
+  try:
+    with open('/proc/self/status') as f:
+      for line in f:
+        if line.startswith('Cpus_allowed:'):
+          mask = int(line.split(':')[1].strip().replace(',', ''), 16)
+          return max(1, bin(mask).count('1'))
+  except (IOError, ValueError):
+    pass
+  return multiprocessing.cpu_count()
 
 def _compound_project_name(args):
   """ Builds a compound project name such as google.com:my-project
@@ -105,9 +136,21 @@ def _compound_project_name(args):
   return container_util.compound_project_name(args.cloud_project_prefix,
                                               args.cloud_project_name)
 def _setup(args):
-  subprocess.check_call(["git", "submodule", "init"])
-  subprocess.check_call(["git", "submodule", "update"])
-  subprocess.check_call(["./setup.sh"])
+  # Installing the sysroot packages does not depend on the submodules so do it
+  # while they are being fetched. Fetching the submodules is network bound so
+  # use more jobs than CPUs.
+  sysroot_process = subprocess.Popen(["./setup.sh", "-c"])
+  submodule_cmd = ["git", "submodule", "update", "--init", "--jobs",
+                   str(max(4, multiprocessing.cpu_count()))]
+  submodule_status = subprocess.call(submodule_cmd)
+  sysroot_status = sysroot_process.wait()
+  if submodule_status:
+    raise subprocess.CalledProcessError(submodule_status,
+                                        " ".join(submodule_cmd))
+  if sysroot_status:
+    raise subprocess.CalledProcessError(sysroot_status, "./setup.sh -c")
+  # The rest of setup.sh builds code from the submodules.
+  subprocess.check_call(["./setup.sh", "-s"])
 
 def _update_config(args):
   savedDir = os.getcwd()
@@ -119,11 +162,26 @@ def _update_config(args):
 
 def _build(args):
   ensureDir(OUT_DIR)
-  savedir = os.getcwd()
-  os.chdir(OUT_DIR)
-  subprocess.check_call([args.cmake_path, '-G', 'Ninja','..'])
-  subprocess.check_call([args.ninja_path])
-  os.chdir(savedir)
+  # Only run cmake if the out directory has not been configured yet or the top
+  # level CMakeLists.txt has changed since it was. Changes to the other
+  # CMakeLists.txt files are picked up by ninja, which reruns cmake itself.
+  cmake_cache = os.path.join(OUT_DIR, 'CMakeCache.txt')
+  if (not os.path.exists(cmake_cache) or
+      not os.path.exists(os.path.join(OUT_DIR, 'build.ninja')) or
+      os.path.getmtime(os.path.join(THIS_DIR, 'CMakeLists.txt')) >
+          os.path.getmtime(cmake_cache)):
+    # Use ccache as the compiler launcher if it is installed. This only needs
+    # to happen when configuring since cmake remembers it in the cache.
+    ccache_args = []
+    if distutils.spawn.find_executable('ccache'):
+      ccache_args = ['-DCMAKE_C_COMPILER_LAUNCHER=ccache',
+                     '-DCMAKE_CXX_COMPILER_LAUNCHER=ccache']
+    subprocess.check_call([args.cmake_path, '-G', 'Ninja'] + ccache_args +
+                          ['..'], cwd=OUT_DIR)
+  # Ninja also stops starting new jobs while the load average is above the
+  # number of CPUs.
+  subprocess.check_call([args.ninja_path, '-j', str(args.jobs),
+                         '-l', str(multiprocessing.cpu_count())], cwd=OUT_DIR)
 
 def _check_config(args):
   config_parser_bin = os.path.join(OUT_DIR, 'config', 'config_parser',
@@ -136,48 +194,104 @@ def _check_config(args):
       '-check_only'])
 
 def _lint(args):
-  status = 0
-  status += cpplint.main()
-  status += golint.main()
+  if args.serial:
+    status = 0
+    status += cpplint.main()
+    status += golint.main()
+    exit(status)
+
+  # The two linters look at disjoint sets of files so run them concurrently.
+  pool = multiprocessing.Pool(2)
+  try:
+    results = [pool.apply_async(linter.main) for linter in (cpplint, golint)]
+    status = sum(result.get(_POOL_TIMEOUT_SECS) for result in results)
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
 
   exit(status)
 
+# Returns the sorted names of the test executables in the directory |test_dir|
+# under the out directory, or None if that directory does not exist.
+def _list_test_executables(test_dir):
+  tdir = os.path.join(OUT_DIR, test_dir)
+  if not os.path.isdir(tdir):
+    return None
+  return sorted(os.listdir(tdir))
+
+# Writes |lines| to stdout with a single write so that the banners printed by
+# concurrently running test directories do not interleave.
+def _print_banner(lines):
+  sys.stdout.write('\n'.join(lines) + '\n')
+  sys.stdout.flush()
+
+# Runs the tests in |test_dir|, trying up to |num_times_to_try| times, and
+# returns the list of failures from the last attempt. Unless |quiet| is True a
+# banner is printed before the tests and before each retry. This is a top-level
+# function so that it can be handed to a multiprocessing.Pool.
+def _run_one_test_dir(test_dir, num_times_to_try, run_kwargs, quiet=False):
+  if not quiet:
+    what = test_dir
+    if run_kwargs.get('test_executables'):
+      what = '%s/%s' % (test_dir, ','.join(run_kwargs['test_executables']))
+    _print_banner(['********************************************************',
+                   'Running tests in %s.' % what])
+  this_failure_list = []
+  for attempt in range(num_times_to_try):
+    this_failure_list = test_runner.run_all_tests(test_dir, **run_kwargs)
+    if  this_failure_list and attempt < num_times_to_try - 1:
+      if not quiet:
+        _print_banner(['', '***** Attempt %i of %s failed. Retrying...' %
+                       (attempt, this_failure_list), ''])
+    else:
+      break;
+  return this_failure_list
+
 # Specifiers of subsets of tests to run
 TEST_FILTERS =['all', 'gtests', 'nogtests', 'gotests', 'nogotests',
                'btemulator', 'nobtemulator', 'e2e', 'noe2e', 'cloud_bt', 'perf']
 
+# A map from positive filter specifiers to the list of test directories
+# it represents. Note that 'cloud_bt' and 'perf' tests are special. They are
+# not included in 'all'. They are only run if asked for explicitly. The lists
+# are in the order in which the directories are run.
+FILTER_MAP = {
+  'all': ['gtests', 'go_tests', 'gtests_btemulator', 'e2e_tests'],
+  'gtests': ['gtests'],
+  'gotests' : ['go_tests'],
+  'btemulator': ['gtests_btemulator'],
+  'e2e': ['e2e_tests'],
+  'cloud_bt' : ['gtests_cloud_bt'],
+  'perf' : ['perf_tests']
+}
+
+# The set of test directories for which the contained tests assume the
+# existence of a running instance of the Bigtable Emulator.
+NEEDS_BT_EMULATOR = frozenset(['gtests_btemulator', 'e2e_tests'])
+
+# The set of test directories for which the contained tests assume the
+# existence of a running instance of the Cobalt processes (Shuffler,
+# Analyzer Service, Report Master.)
+NEEDS_COBALT_PROCESSES = frozenset(['e2e_tests'])
+
+# The set of test directories for which the contained tests do not depend on
+# any shared external state and so may be run concurrently.
+CAN_RUN_IN_PARALLEL = frozenset(['gtests', 'go_tests'])
+
 # Returns 0 if all tests pass, otherwise returns 1. Prints a failure or success
 # message.
 def _test(args):
-  # A map from positive filter specifiers to the list of test directories
-  # it represents. Note that 'cloud_bt' and 'perf' tests are special. They are
-  # not included in 'all'. They are only run if asked for explicitly.
-  FILTER_MAP = {
-    'all': ['gtests', 'go_tests', 'gtests_btemulator', 'e2e_tests'],
-    'gtests': ['gtests'],
-    'gotests' : ['go_tests'],
-    'btemulator': ['gtests_btemulator'],
-    'e2e': ['e2e_tests'],
-    'cloud_bt' : ['gtests_cloud_bt'],
-    'perf' : ['perf_tests']
-  }
-
-  # A list of test directories for which the contained tests assume the
-  # existence of a running instance of the Bigtable Emulator.
-  NEEDS_BT_EMULATOR=['gtests_btemulator', 'e2e_tests']
-
-  # A list of test directories for which the contained tests assume the
-  # existence of a running instance of the Cobalt processes (Shuffler,
-  # Analyzer Service, Report Master.)
-  NEEDS_COBALT_PROCESSES=['e2e_tests']
-
   # By default try each test just once.
   num_times_to_try = 1
 
   # Get the list of test directories we should run.
   if args.tests.startswith('no'):
+    excluded_dirs = frozenset(FILTER_MAP[args.tests[2:]])
     test_dirs = [test_dir for test_dir in FILTER_MAP['all']
-        if test_dir not in FILTER_MAP[args.tests[2:]]]
+        if test_dir not in excluded_dirs]
   else:
     test_dirs = FILTER_MAP[args.tests]
 
@@ -185,6 +299,9 @@ def _test(args):
   print ("Will run tests in the following directories: %s." %
       ", ".join(test_dirs))
 
+  # A list of (test_dir, num_times_to_try, run_all_tests kwargs) tuples.
+  test_runs = []
+
   bigtable_project_name = ''
   bigtable_instance_id = ''
   for test_dir in test_dirs:
@@ -306,29 +423,65 @@ def _test(args):
         test_args = test_args + [
           "-do_shuffler_threshold_test=false",
         ]
-    print '********************************************************'
-    this_failure_list = []
-    for attempt in range(num_times_to_try):
-      this_failure_list = test_runner.run_all_tests(
-          test_dir, start_bt_emulator=start_bt_emulator,
-          start_cobalt_processes=start_cobalt_processes,
-          bigtable_project_name=bigtable_project_name,
-          bigtable_instance_id=bigtable_instance_id,
-          verbose_count=_verbose_count,
-          vmodule=_vmodule,
-          use_tls=_parse_bool(args.use_tls),
-          tls_cert_file=args.tls_cert_file,
-          tls_key_file=args.tls_key_file,
-          test_args=test_args)
-      if  this_failure_list and attempt < num_times_to_try - 1:
-        print
-        print '***** Attempt %i of %s failed. Retrying...' % (attempt,
-            this_failure_list)
-        print
-      else:
-        break;
-    if this_failure_list:
-      failure_list.append("%s (%s)" % (test_dir, this_failure_list))
+    test_runs.append((test_dir, num_times_to_try, {
+        'start_bt_emulator': start_bt_emulator,
+        'start_cobalt_processes': start_cobalt_processes,
+        'bigtable_project_name': bigtable_project_name,
+        'bigtable_instance_id': bigtable_instance_id,
+        'verbose_count': _verbose_count,
+        'vmodule': _vmodule,
+        'use_tls': _parse_bool(args.use_tls),
+        'tls_cert_file': args.tls_cert_file,
+        'tls_key_file': args.tls_key_file,
+        'test_args': test_args,
+    }))
+
+  # Directories that touch no shared external state are run concurrently in a
+  # process pool, one task per test executable so that a single slow executable
+  # does not hold up the rest of its directory. The other directories (the ones
+  # that use the Bigtable emulator or the Cobalt processes on fixed ports) are
+  # run one at a time afterwards.
+  parallel_runs = []
+  serial_runs = []
+  for run in test_runs:
+    test_dir, num_times_to_try, run_kwargs = run
+    if test_dir not in CAN_RUN_IN_PARALLEL:
+      serial_runs.append(run)
+      continue
+    test_executables = _list_test_executables(test_dir)
+    if not test_executables:
+      # Let run_all_tests() report the missing directory.
+      parallel_runs.append(run)
+      continue
+    for test_executable in test_executables:
+      parallel_runs.append((test_dir, num_times_to_try,
+                            dict(run_kwargs,
+                                 test_executables=[test_executable])))
+  results = dict((test_dir, []) for test_dir, _, _ in test_runs)
+  if len(parallel_runs) > 1:
+    num_workers = min(len(parallel_runs),
+                      max(1, _usable_cpu_count() - 2))
+    pool = multiprocessing.Pool(num_workers)
+    try:
+      pending = [(run[0], pool.apply_async(_run_one_test_dir,
+                                           run + (args.quiet,)))
+                 for run in parallel_runs]
+      for test_dir, result in pending:
+        results[test_dir] += result.get(_POOL_TIMEOUT_SECS) or []
+      pool.close()
+    except:
+      pool.terminate()
+      raise
+    finally:
+      pool.join()
+  else:
+    serial_runs = parallel_runs + serial_runs
+  for run in serial_runs:
+    results[run[0]] += _run_one_test_dir(*(run + (args.quiet,))) or []
+
+  for test_dir, _, _ in test_runs:
+    if results[test_dir]:
+      failure_list.append("%s (%s)" % (test_dir, results[test_dir]))
 
   print
   if failure_list:
@@ -362,8 +515,10 @@ def _clean(args):
         else:
            shutil.rmtree(full_path, ignore_errors=True)
 
+# The _start_* commands have nothing left to do once the process they start
+# exits so they replace the cobaltb.py process with it rather than waiting.
 def _start_bigtable_emulator(args):
-  process_starter.start_bigtable_emulator()
+  process_starter.start_bigtable_emulator(replace_process=True)
 
 
 def _start_shuffler(args):
@@ -375,9 +530,8 @@ def _start_shuffler(args):
                                  use_tls=_parse_bool(args.use_tls),
                                  tls_cert_file=args.tls_cert_file,
                                  tls_key_file=args.tls_key_file,
-                                 # Because it makes the demo more interesting
-                                 # we use verbose_count at least 3.
-                                 verbose_count=max(3, _verbose_count))
+                                 verbose_count=_demo_verbose_count,
+                                 replace_process=True)
 
 def _start_analyzer_service(args):
   bigtable_project_name = ''
@@ -388,9 +542,8 @@ def _start_analyzer_service(args):
   process_starter.start_analyzer_service(port=args.port,
       bigtable_project_name=bigtable_project_name,
       bigtable_instance_id=bigtable_instance_id,
-      # Because it makes the demo more interesting
-      # we use verbose_count at least 3.
-      verbose_count=max(3, _verbose_count))
+      verbose_count=_demo_verbose_count,
+      replace_process=True)
 
 def _start_report_master(args):
   bigtable_project_name = ''
@@ -404,7 +557,8 @@ def _start_report_master(args):
       use_tls=_parse_bool(args.use_tls),
       tls_cert_file=args.tls_cert_file,
       tls_key_file=args.tls_key_file,
-      verbose_count=_verbose_count)
+      verbose_count=_verbose_count,
+      replace_process=True)
 
 def _start_test_app(args):
   analyzer_uri = "localhost:%d" % DEFAULT_ANALYZER_SERVICE_PORT
@@ -421,10 +575,13 @@ def _start_test_app(args):
         'analyzer_public.pem')
     shuffler_public_key_pem = os.path.join(pem_directory,
         'shuffler_public.pem')
-  if args.cobalt_on_personal_cluster or args.production_dir:
+  # Only ask the cluster for its public URIs if we do not already have a
+  # preferred address since that requires running kubectl.
+  if ((args.cobalt_on_personal_cluster or args.production_dir) and
+      not args.shuffler_preferred_address):
     public_uris = container_util.get_public_uris(args.cluster_name,
         args.cloud_project_prefix, args.cloud_project_name, args.cluster_zone)
-    shuffler_uri = args.shuffler_preferred_address or public_uris["shuffler"]
+    shuffler_uri = public_uris["shuffler"]
   process_starter.start_test_app(shuffler_uri=shuffler_uri,
       analyzer_uri=analyzer_uri,
       analyzer_pk_pem_file=analyzer_public_key_pem,
@@ -433,24 +590,26 @@ def _start_test_app(args):
       shuffler_pk_pem_file=shuffler_public_key_pem,
       project_id=args.project_id,
       automatic=args.automatic,
-      # Because it makes the demo more interesting
-      # we use verbose_count at least 3.
-      verbose_count=max(3, _verbose_count))
+      verbose_count=_demo_verbose_count,
+      replace_process=True)
 
 def _start_report_client(args):
   report_master_uri = (args.report_master_preferred_address or
       "localhost:%d" % DEFAULT_REPORT_MASTER_PORT)
-  if args.cobalt_on_personal_cluster or args.production_dir:
+  # Only ask the cluster for its public URIs if we do not already have a
+  # preferred address since that requires running kubectl.
+  if ((args.cobalt_on_personal_cluster or args.production_dir) and
+      not args.report_master_preferred_address):
     public_uris = container_util.get_public_uris(args.cluster_name,
         args.cloud_project_prefix, args.cloud_project_name, args.cluster_zone)
-    report_master_uri = (args.report_master_preferred_address
-            or public_uris["report_master"])
+    report_master_uri = public_uris["report_master"]
   process_starter.start_report_client(
       report_master_uri=report_master_uri,
       use_tls=_parse_bool(args.use_tls),
       root_certs_pem_file=args.report_master_root_certs,
       project_id=args.project_id,
-      verbose_count=_verbose_count)
+      verbose_count=_verbose_count,
+      replace_process=True)
 
 def _start_observation_querier(args):
   bigtable_project_name = ''
@@ -461,7 +620,8 @@ def _start_observation_querier(args):
   process_starter.start_observation_querier(
       bigtable_project_name=bigtable_project_name,
       bigtable_instance_id=bigtable_instance_id,
-      verbose_count=_verbose_count)
+      verbose_count=_verbose_count,
+      replace_process=True)
 
 def _generate_keys(args):
   path = os.path.join(OUT_DIR, 'tools', 'key_generator', 'key_generator')
@@ -605,19 +765,48 @@ def _deploy_production_build(args):
 
 
 
+# The jobs that can be deployed to GKE.
+DEPLOY_JOBS = ['shuffler', 'analyzer-service', 'report-master']
+
+# A map from each of DEPLOY_JOBS to the function that pushes its image to the
+# Container Registry.
+PUSH_FUNCTIONS = {
+  'shuffler': container_util.push_shuffler_to_container_registry,
+  'analyzer-service':
+      container_util.push_analyzer_service_to_container_registry,
+  'report-master': container_util.push_report_master_to_container_registry,
+}
+
+# A map from each of DEPLOY_JOBS to the function that stops it.
+STOP_FUNCTIONS = {
+  'shuffler': container_util.stop_shuffler,
+  'analyzer-service': container_util.stop_analyzer_service,
+  'report-master': container_util.stop_report_master,
+}
+
 def _deploy_push(args):
-  if args.job == 'shuffler':
-    container_util.push_shuffler_to_container_registry(
-        args.cloud_project_prefix, args.cloud_project_name)
-  elif args.job == 'analyzer-service':
-    container_util.push_analyzer_service_to_container_registry(
-        args.cloud_project_prefix, args.cloud_project_name)
-  elif args.job == 'report-master':
-    container_util.push_report_master_to_container_registry(
-        args.cloud_project_prefix, args.cloud_project_name)
+  if args.job in PUSH_FUNCTIONS:
+    PUSH_FUNCTIONS[args.job](args.cloud_project_prefix,
+                             args.cloud_project_name)
+  elif args.job == 'all':
+    # The pushes are network bound so do them concurrently.
+    pool = multiprocessing.pool.ThreadPool(len(DEPLOY_JOBS))
+    try:
+      results = [pool.apply_async(PUSH_FUNCTIONS[job],
+                                  (args.cloud_project_prefix,
+                                   args.cloud_project_name))
+                 for job in DEPLOY_JOBS]
+      for result in results:
+        result.get(_POOL_TIMEOUT_SECS)
+      pool.close()
+    except:
+      pool.terminate()
+      raise
+    finally:
+      pool.join()
   else:
     print('Unknown job "%s". I only know how to push "shuffler", '
-          '"analyzer-service" and "report-master".' % args.job)
+          '"analyzer-service", "report-master" and "all".' % args.job)
 
 def _parse_bool(bool_string):
   return bool_string.lower() in ['true', 't', 'y', 'yes', '1']
@@ -689,19 +878,10 @@ def _deploy_start(args):
           '"analyzer-service" and "report-master".' % args.job)
 
 def _deploy_stop(args):
-  version = _load_versions_file(args).get(args.job, 'latest')
-  components = [c.strip() for c in args.components.split(',')]
-
-  if args.job == 'shuffler':
-    container_util.stop_shuffler(args.cloud_project_prefix,
-        args.cloud_project_name, args.cluster_zone, args.cluster_name,
-        components, version)
-  elif args.job == 'analyzer-service':
-    container_util.stop_analyzer_service(args.cloud_project_prefix,
-        args.cloud_project_name, args.cluster_zone, args.cluster_name,
-        components, version)
-  elif args.job == 'report-master':
-    container_util.stop_report_master(args.cloud_project_prefix,
+  if args.job in STOP_FUNCTIONS:
+    version = _load_versions_file(args).get(args.job, 'latest')
+    components = [c.strip() for c in args.components.split(',')]
+    STOP_FUNCTIONS[args.job](args.cloud_project_prefix,
         args.cloud_project_name, args.cluster_zone, args.cluster_name,
         components, version)
   else:
@@ -949,7 +1129,7 @@ def _add_deploy_start_stop_args(parser, cluster_settings, verb):
   parser.add_argument('--deployed_versions_file',
       help='A file with version numbers to use',
       default=cluster_settings['deployed_versions_file'])
-  parser.add_argument('--job',
+  parser.add_argument('--job', choices=DEPLOY_JOBS,
       help='The job you wish to ' + verb + '. Valid choices are "shuffler", '
            '"analyzer-service", "report-master". Required.')
   parser.add_argument('--components',
@@ -1141,6 +1321,10 @@ def main():
                           help='Path to CMake binary')
   sub_parser.add_argument('--ninja_path', default='ninja',
                           help='Path to Ninja binary')
+  sub_parser.add_argument('--jobs', type=int,
+                          default=max(1, _usable_cpu_count() - 2),
+                          help='Number of jobs for Ninja to run in parallel. '
+                          'Default=%(default)s')
   sub_parser.set_defaults(func=_build)
 
   ########################################################
@@ -1149,6 +1333,10 @@ def main():
   sub_parser = subparsers.add_parser('lint', parents=[parent_parser],
     help='Run language linters on all source files.')
   sub_parser.set_defaults(func=_lint)
+  sub_parser.add_argument('--serial',
+      help='Run the linters one after the other instead of concurrently so '
+      'that their output is not interleaved.',
+      action='store_true')
 
   ########################################################
   # test command
@@ -1159,6 +1347,10 @@ def main():
   sub_parser.add_argument('--tests', choices=TEST_FILTERS,
       help='Specify a subset of tests to run. Default=all',
       default='all')
+  sub_parser.add_argument('--quiet',
+      help='Do not print a banner before each test directory and retry. The '
+      'final summary is always printed.',
+      action='store_true')
   sub_parser.add_argument('-use_cloud_bt',
       help='Causes the end-to-end tests to run using local instances of the '
       'Cobalt processes connected to an instance of Cloud Bigtable. Otherwise '
@@ -1688,9 +1880,9 @@ def main():
       parents=[parent_parser], help='Push a Docker image to the Google'
           'Container Registry.')
   sub_parser.set_defaults(func=_deploy_push)
-  sub_parser.add_argument('--job',
+  sub_parser.add_argument('--job', choices=DEPLOY_JOBS + ['all'],
       help='The job you wish to push. Valid choices are "shuffler", '
-           '"analyzer-service", "report-master". Required.')
+           '"analyzer-service", "report-master", "all". Required.')
   _add_gke_deployment_args(sub_parser, cluster_settings)
 
   sub_parser = deploy_subparsers.add_parser('start',
@@ -1797,6 +1989,8 @@ def main():
   args = parser.parse_args()
   global _verbose_count
   _verbose_count = args.verbose_count
+  global _demo_verbose_count
+  _demo_verbose_count = max(3, _verbose_count)
   _initLogging(_verbose_count)
   global _vmodule
   _vmodule = args.vmodule
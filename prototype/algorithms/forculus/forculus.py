@@ -21,18 +21,26 @@ popular messages.
 
 import base64
 import binascii
+import collections
 import csv
 import datetime
+import hashlib
+import hmac
+import itertools
+import multiprocessing
 import pprint
 import random
 import sys
+import tempfile
 
-from Crypto.Cipher import AES
-from Crypto.Hash import HMAC
-from Crypto.Hash import SHA256
-
-from struct import pack
-from struct import unpack
+# Prefer pycryptodomex, which dispatches to AES-NI at runtime when the CPU
+# supports it. Fall back to the legacy PyCrypto package otherwise.
+try:
+  from Cryptodome.Cipher import AES
+  from Cryptodome.Util import Counter
+except ImportError:
+  from Crypto.Cipher import AES
+  from Crypto.Util import Counter
 
 
 class Config(object):
@@ -79,9 +87,13 @@ class Config(object):
 
     return p
 
+# Set to True for logging, False otherwise. Every call to _log() is guarded by
+# this flag so that the (often large) log messages are not even formatted
+# when logging is disabled.
+_LOGGING_ENABLED = False
+
 def _log(string):
-  logging_flag = False  # set to True for logging, False otherwise
-  if logging_flag:
+  if _LOGGING_ENABLED:
     if isinstance(string, dict):
       print >> sys.stderr, "[" + str(datetime.datetime.now()) + "]"
       pp = pprint.PrettyPrinter(indent=2, stream=sys.stderr)
@@ -90,7 +102,9 @@ def _log(string):
       print >> sys.stderr, "[" + str(datetime.datetime.now()) + "]\t" + string
 
 
-ZERO_HMAC = HMAC.new("0"*160, digestmod=SHA256)
+# HMAC-SHA256 is computed with the standard library, which uses OpenSSL's
+# SHA256 implementation (including the SHA extensions on CPUs that have them).
+ZERO_HMAC = hmac.new("0"*160, digestmod=hashlib.sha256)
 def _ro_hmac(msg, h=None):
   """Implements random oracle H as HMAC-SHA256 with the all-zero key.
 
@@ -111,6 +125,8 @@ def _ro_hmac(msg, h=None):
   return h.digest()
 
 # Simple function to unpack bytes from a big-endian byte string into an integer.
+# Both hexlify and the base-16 int parser run in C, so this does no
+# per-byte work in the interpreter.
 def _unpack_bytes(string):
   return int(binascii.hexlify(string), 16)
 
@@ -120,13 +136,12 @@ def _unpack_bytes(string):
 # will have length at least |min_length|. Zero bytes will be pre-pended
 # if necessary.
 def _pack_into_bytes(integer, min_length=16):
-  s = '%x' % integer
+  # Zero-pad the hex representation to the minimum length up front so that
+  # a single unhexlify() produces the final string.
+  s = '%0*x' % (2 * max(min_length, 0), integer)
   if len(s) % 2 == 1:
     s = '0' + s
-  string = binascii.unhexlify(s)
-  if min_length > 0 and len(string) < min_length:
-    string = str(bytearray([0] * (min_length- len(string)))) + string
-  return string
+  return binascii.unhexlify(s)
 
 def _DE_enc(key, msg):
   """Implements deterministic encryption.
@@ -150,20 +165,18 @@ def _DE_enc(key, msg):
   return iv, ciphertext
 
 
+# The padding for a message whose length mod 16 is k is _CBC_PADDING[k]: zero
+# bytes followed by a last byte holding the total padding length.
+_CBC_PADDING = ['\x00' * (15 - k) + chr(16 - k) for k in xrange(16)]
+
 # Implements simple padding to multiple of 16 bytes.
 def _CBC_pad_msg(msg):
-  length = len(msg) + 1  # +1 for last padding length byte
-  if length % 16 == 0:
-    return msg + '\x01'
-  plength = 16 - (length % 16) + 1  # +1 for last padding length byte
-  padding = '\x00' * (plength - 1) + pack('b', plength)
-  return msg + padding
+  return msg + _CBC_PADDING[len(msg) % 16]
 
 
 # Removes simple padding.
 def _CBC_remove_padding(msg):
-  plength = unpack('b', msg[-1])[0]  # unpack returns a tuple
-  return msg[:-plength]
+  return msg[:-ord(msg[-1])]
 
 
 # Simple function to decrypt message given key, iv, and ciphertext.
@@ -173,81 +186,107 @@ def _DE_dec(key, iv, ciphertext):
   return _CBC_remove_padding(msg)
 
 
-def _egcd(b, n):
-  """Performs the extended Euclidean algorithm.
-
-  Args:
-    b: Input
-    n: Modulus
-
-  Returns:
-    g, x, y: such that ax + by = g = gcd(a, b)
-  """
-  x0, x1, y0, y1 = 1, 0, 0, 1
-  while n != 0:
-    q, b, n = b // n, n, b % n
-    x0, x1 = x1, x0 - q * x1
-    y0, y1 = y1, y0 - q * y1
-  return  b, x0, y0
-
-
-# Returns the multiplicative inverse of b mod n if it exists.
-def _mult_inv(b, n):
-  g, x, _ = _egcd(b, n)
-  if g == 1:
-    return x % n
-
-
-# Returns x such that x * b = a mod q.
-def _div(q, a, b):
-  return (a * _mult_inv(b, q)) % q
+# Returns the multiplicative inverse of b mod the prime p if it exists.
+# By Fermat's little theorem b^(p-2) is the inverse of b, and the modular
+# exponentiation runs in C rather than as a Python loop.
+def _mult_inv(b, p):
+  if b % p == 0:
+    return None
+  return pow(b, p - 2, p)
 
 
 # Performs lagrange interpolation and returns constant term of the polyonmial
-# Tuples are of the form (x_i, y_i)
-def _compute_c0_lagrange(tuples, threshold, q):
-  x = [0 for i in xrange(0, threshold)]
-  y = [0 for i in xrange(0, threshold)]
-  count = 0
-
-  # Add tuples into arrays x and y
-  for member in tuples:
-    x[count] = int(member[0])
-    y[count] = int(member[1])
-    count += 1
-    if count >= threshold:
-      break
-
-  _log("X: " + ", ".join(["%f"] * len(x)) % tuple(x))
-  _log("Y: " + ", ".join(["%f"] * len(y)) % tuple(y))
+# The points are (x[i], y[i]) for parallel lists of integers x and y. Only the
+# first |threshold| points are used.
+def _compute_c0_lagrange(x, y, threshold, q):
+  x = x[:threshold]
+  y = y[:threshold]
+
+  if _LOGGING_ENABLED:
+    _log("X: " + ", ".join(["%f"] * len(x)) % tuple(x))
+    _log("Y: " + ", ".join(["%f"] * len(y)) % tuple(y))
 
   prod_xi = 1
   for i in xrange(0, threshold):
     prod_xi = (prod_xi  * x[i]) % q
 
-  _log("prod_xi 0x%x" % prod_xi)
+  if _LOGGING_ENABLED:
+    _log("prod_xi 0x%x" % prod_xi)
 
-  temp_sum = 0
+  # Compute all of the denominators d[i] = x[i] * prod_{j != i}(x[j] - x[i])
+  # first so that they can be inverted together below.
+  d = [0] * threshold
   for i in xrange(0, threshold):
     prod_yjyi = 1
     for j in xrange(0, threshold):
       if i == j:
         continue
       prod_yjyi = (prod_yjyi * (x[j] - x[i])) % q
-    product = (x[i] * prod_yjyi) % q
-    quotient = _div(q, y[i], product)
-    temp_sum = (temp_sum + quotient) % q
+    d[i] = (x[i] * prod_yjyi) % q
+
+  # Invert all of the denominators with a single modular inversion
+  # (Montgomery's trick): invert the product of all of them and then peel
+  # off one factor at a time using the prefix products.
+  prefix = [1] * (threshold + 1)
+  for i in xrange(0, threshold):
+    prefix[i + 1] = (prefix[i] * d[i]) % q
+  inv = _mult_inv(prefix[threshold], q)
 
-  _log("temp_sum 0x%x" % temp_sum)
+  temp_sum = 0
+  for i in xrange(threshold - 1, -1, -1):
+    # Here inv is the inverse of d[0] * ... * d[i].
+    inv_d = (inv * prefix[i]) % q
+    inv = (inv * d[i]) % q
+    temp_sum = (temp_sum + y[i] * inv_d) % q
+
+  if _LOGGING_ENABLED:
+    _log("temp_sum 0x%x" % temp_sum)
   return (prod_xi * temp_sum) % q
 
+# Decrypts the ciphertext whose polynomial passes through the given points.
+def _decrypt(iv, ctxt, eval_points, eval_data, threshold, q):
+  # Use first threshold values to do Lagrange interpolation
+  # TODO(pseudorandom, rudominer): Ensure that first threshold values
+  # have unique interpolation points (otherwise the interpolation will fail
+  # ungracefully).
+  c0 = _compute_c0_lagrange(eval_points, eval_data, threshold, q)
+  if _LOGGING_ENABLED:
+    _log("c0: 0x%x" % c0)
+  ptxt = _DE_dec(_pack_into_bytes(int(c0))[:16], iv, ctxt)
+  if _LOGGING_ENABLED:
+    _log("ptxt: %s" % ptxt)
+  return ptxt
+
+
+# Calls _decrypt() with the arguments in the tuple |task|. This is a module
+# level function so that it can be sent to a multiprocessing.Pool.
+def _decrypt_task(task):
+  return _decrypt(*task)
+
+
+# The maximum number of plaintexts for which _Forculus caches derived values.
+_MAX_CACHE_SIZE = 100000
+
+# ForculusEvaluator decrypts in a pool of worker processes, one per CPU, when
+# at least this many plaintexts are to be recovered. Below this the cost of
+# starting the workers outweighs the gain.
+_MIN_PARALLEL_DECRYPTIONS = 64
+
+# The number of rows ForculusEvaluator passes to a batch decryption function
+# at a time.
+_DECRYPTION_BATCH_SIZE = 1024
+
+# The timeout for the parallel decryptions. Python 2 can not interrupt a wait
+# for the pool without a timeout so a Ctrl-C would otherwise hang.
+_POOL_TIMEOUT_SECS = 7 * 24 * 60 * 60
+
 class _Forculus(object):
   """Private Forculus class with relevant helper functions.
   The public API is exposed through the subclasses ForculusInserter
   and ForculusEvaluator.
   """
 
-  def __init__(self, threshold):
+  def __init__(self, threshold, legacy_coefficients=False):
     # Parameters
     if threshold is None:
       self.threshold = 100
@@ -263,72 +302,106 @@ class _Forculus(object):
     # self.q = 37  # Prime (FOR TESTING ONLY)
     # self.Fq = GF(self.q)  # Field
     self.eparam = 1  # TODO(pseudorandom): eparam must be fetched from file
+    # The exclusive upper bound of the random value from which each
+    # evaluation point is derived.
+    self._eval_bound = (self.threshold**2) * (2 ** 80)
     random.seed()
-    # For performance reasons we cache the coefficients, iv, and ciphertext
-    # corresponding to to a plaintext so we don't have to recompute them. The
-    # keys to the dictionary are plaintext and the values are a tuple consisting
-    # of the coeeficient list, the iv, and the ciphertext
-    self.cache = {}
+    # For performance reasons we cache the message-derived key, iv, and
+    # ciphertext corresponding to a plaintext so we don't have to recompute
+    # them. The keys to the dictionary are plaintexts and the values are a
+    # tuple consisting of the key, the iv, and the ciphertext. The
+    # coefficients are not cached because they are cheap to re-derive from the
+    # key and would multiply the size of each entry by |threshold|. At most
+    # _MAX_CACHE_SIZE entries are kept, evicting the least recently used.
+    self.cache = collections.OrderedDict()
+    # If True the coefficients are derived with the original HMAC chain,
+    # which reproduces databases written before the AES-CTR derivation was
+    # introduced.
+    self.legacy_coefficients = legacy_coefficients
 
   #
   # INTERNAL FUNCTIONS
   #
+  def _ComputeCoefficients(self, ckey):
+    """Deterministically derives the |threshold| polynomial coefficients
+    from the message-derived key |ckey|.
+
+    The coefficients are read from the AES-CTR keystream under |ckey|, so all
+    of them are produced by a single call into the cipher instead of one HMAC
+    per coefficient.
+    """
+    if self.legacy_coefficients:
+      # This is the original derivation: a single HMAC keyed with |ckey| is
+      # fed str(0), str(1), ... in order and its digest is taken after each
+      # update, so that c[i] is HMAC(ckey, "01...i").
+      h = hmac.new(ckey, digestmod=hashlib.sha256)
+      return [_unpack_bytes(_ro_hmac(str(i), h)) % self.q
+              for i in xrange(0, self.threshold)]
+    ctr = Counter.new(128, initial_value=0)
+    stream = AES.new(ckey, AES.MODE_CTR, counter=ctr).encrypt(
+        '\x00' * (32 * self.threshold))
+    return [_unpack_bytes(stream[i:i + 32]) % self.q
+            for i in xrange(0, 32 * self.threshold, 32)]
+
   def _Encrypt(self, ptxt):
-    # For performance reasons we create a single instance of HMAC and re-use
-    # it for each of the coefficients.
-    h = ZERO_HMAC.copy()
-    if ptxt in self.cache:
-      c, iv, ctxt = self.cache[ptxt]
+    # Popping the entry and re-inserting it below keeps the cache in least
+    # recently used order.
+    cached = self.cache.pop(ptxt, None)
+    if cached is not None:
+      ckey, iv, ctxt = cached
+      c = self._ComputeCoefficients(ckey)
     else:
-      c = [0] * self.threshold
-      # Notice we do a double round of HMAC here. First we create a key
-      # by using the ZERO_HMAC to hash the plain text.
-      ckey = _ro_hmac(str(1) + str(self.eparam) + ptxt, h)
-      # Then we create a new HMAC object using this key.
-      # This single HMAC object is used to generate each of the coefficients.
-      h = HMAC.new(ckey, digestmod=SHA256)
-      for i in xrange(0, self.threshold):
-        c[i] = _unpack_bytes(_ro_hmac(str(i), h)) % self.q
+      # Notice we do a double round of keyed derivation here. First we create
+      # a key by using the ZERO_HMAC to hash the plain text. Then we use this
+      # key to generate each of the coefficients.
+      ckey = _ro_hmac(str(1) + str(self.eparam) + ptxt)
+      c = self._ComputeCoefficients(ckey)
       iv, ctxt = _DE_enc(_pack_into_bytes(c[0])[:16], ptxt)
-      self.cache[ptxt] = (c, iv, ctxt)
-
-    _log("Key, i.e., c0: %d" % c[0])
-    _log("Rest of coefficients: " + ", ".join(["%d"] * (self.threshold-1)) %
-         tuple(c[1:]))
-
-    eval_point = random.randrange((self.threshold**2) * (2 ** 80))
-    eval_point = _unpack_bytes(_ro_hmac(str(eval_point), h)) % self.q
-    _log("Eval point: %d" % eval_point)
-
-    # Horner polynomial eval
+      if len(self.cache) >= _MAX_CACHE_SIZE:
+        self.cache.popitem(last=False)
+    self.cache[ptxt] = (ckey, iv, ctxt)
+
+    if _LOGGING_ENABLED:
+      _log("Key, i.e., c0: %d" % c[0])
+      _log("Rest of coefficients: " + ", ".join(["%d"] * (self.threshold-1)) %
+           tuple(c[1:]))
+
+    eval_point = random.randrange(self._eval_bound)
+    eval_point = _unpack_bytes(_ro_hmac(str(eval_point))) % self.q
+    if _LOGGING_ENABLED:
+      _log("Eval point: %d" % eval_point)
+
+    # Horner polynomial eval. Two Horner steps are taken per modular
+    # reduction: the unreduced intermediate value is only a few hundred bits
+    # long, so this halves the number of reductions. Reducing less often than
+    # this was measured to be slower because the multiplications get longer.
     temp_eval = 0
-    for i in xrange(self.threshold - 1, 0, -1):
-      temp_eval = ((temp_eval + c[i]) * eval_point) % self.q
-      _log("(In loop) i = %d, c[i] = %d, temp_eval = %d" % (i, c[i], temp_eval))
+    for i in xrange(self.threshold - 1, 1, -2):
+      temp_eval = (((temp_eval + c[i]) * eval_point + c[i - 1]) *
+                   eval_point) % self.q
+      if _LOGGING_ENABLED:
+        _log("(In loop) i = %d, c[i] = %d, c[i-1] = %d, temp_eval = %d" %
+             (i, c[i], c[i - 1], temp_eval))
+    if self.threshold % 2 == 0:
+      # One coefficient above c[0] is left over.
+      temp_eval = ((temp_eval + c[1]) * eval_point) % self.q
     temp_eval = (temp_eval + c[0]) % self.q
-    _log("Eval data: %d" % temp_eval)
+    if _LOGGING_ENABLED:
+      _log("Eval data: %d" % temp_eval)
     # Return:
     #   IV, ciphertext, random evaluation point, evaluation value, msg. derived
     #   key i.e., C0.
     # message-derived key for debug purposes only.
     return(iv, ctxt, eval_point, temp_eval, c[0])
 
-  def _Decrypt(self, iv, ctxt, dict_vals):
-    # Use first self.threshold values to do Lagrange interpolation
-    # TODO(pseudorandom, rudominer): Ensure that first self.threshold values
-    # have unique interpolation points (otherwise the interpolation will fail
-    # ungracefully).
-    c0 = _compute_c0_lagrange(dict_vals, self.threshold, self.q)
-    _log("c0: 0x%x" % c0)
-    ptxt = _DE_dec(_pack_into_bytes(int(c0))[:16], iv, ctxt)
-    _log("ptxt: %s" % ptxt)
-    return ptxt
+  def _Decrypt(self, iv, ctxt, eval_points, eval_data):
+    return _decrypt(iv, ctxt, eval_points, eval_data, self.threshold, self.q)
 
 class ForculusInserter(_Forculus):
   """ A ForculusInserter is used to insert entries into a Forculus-encrypted
   database.
   """
-  def __init__(self, threshold, e_db):
+  def __init__(self, threshold, e_db, legacy_coefficients=False):
     """ Constructs a new ForculusInserter with the given threshold and the
     given database.
 
@@ -339,8 +412,13 @@ class ForculusInserter(_Forculus):
       e_db {writer}: The database into which encrypted entries will be written.
       Any object with a write() method. If e_db is a file object
       it must have been opened for writing with the 'b' flag.
+
+      legacy_coefficients {bool}: If True, derive the polynomial coefficients
+      with the original HMAC chain scheme. Use this when appending to a
+      database that was written with that scheme, since entries for the same
+      plaintext only group together if they were derived the same way.
     """
-    super(ForculusInserter, self).__init__(threshold)
+    super(ForculusInserter, self).__init__(threshold, legacy_coefficients)
     self.edb_writer = csv.writer(e_db)
 
   def Insert(self, ptxt, additional_encryption_func=None):
@@ -356,6 +434,27 @@ class ForculusInserter(_Forculus):
       corresponding decryption function must be passed to
       ForculusEvaluator.ComputeAndWriteResults().
     """
+    self.edb_writer.writerow(
+        self._EncryptRow(ptxt, additional_encryption_func))
+
+  def InsertMany(self, ptxts, additional_encryption_func=None):
+    """ Insert encrypted versions of each of the given plaintexts into the
+    database.
+
+    This is equivalent to calling Insert() on each plaintext in turn but the
+    rows are handed to the database in a single write.
+
+    Args:
+      ptxts {iterable of string}: The plaintexts to insert.
+
+      additional_encryption_func {function}: As in Insert().
+    """
+    self.edb_writer.writerows([
+        self._EncryptRow(ptxt, additional_encryption_func) for ptxt in ptxts])
+
+  def _EncryptRow(self, ptxt, additional_encryption_func):
+    """ Returns the row to write to the database for the given plaintext.
+    """
     iv, ctxt, eval_point, eval_value, key = self._Encrypt(ptxt)
     data_to_write = [base64.b64encode(iv), base64.b64encode(ctxt),
                      eval_point, eval_value]
@@ -365,7 +464,7 @@ class ForculusInserter(_Forculus):
       # representing the ciphertext. We use that tuple as the data-to-write.
       data_to_write = additional_encryption_func(
           ",".join(map(str,data_to_write)))
-    self.edb_writer.writerow(data_to_write)
+    return data_to_write
 
 class ForculusEvaluator(_Forculus):
   """ A ForculusEvaluator is used to evaluate a Forculus-encrypted database
@@ -385,12 +484,19 @@ class ForculusEvaluator(_Forculus):
       e_db {iterator}: The database from which encrypted entries will be read.
       Any object which supports the iterator protocol and returns a string each
       time its next() method is called. If e_db is a file object
-      it must have been opened for reading with the 'b' flag.
+      it must have been opened for reading with the 'b' flag. If e_db has a
+      seek() method it may be read more than once.
     """
     super(ForculusEvaluator, self).__init__(threshold)
+    self.e_db = e_db
     self.edb_reader = csv.reader(e_db)
+    # The writer for the most recently used result database. It is reused
+    # by later calls to ComputeAndWriteResults() with the same database.
+    self._rdb = None
+    self._rdb_writer = None
 
-  def ComputeAndWriteResults(self, r_db, additional_decryption_func=None):
+  def ComputeAndWriteResults(self, r_db, additional_decryption_func=None,
+                             additional_batch_decryption_func=None):
     """ Reads the entries from the encrypted database and decrypts any
     entries that occur at least |threshold| times. The dycrpted plaintexts
     are written to the result database along with there counts.
@@ -406,30 +512,111 @@ class ForculusEvaluator(_Forculus):
       the ciphertext and return a single string representing the plain text.
       The decryption function should be the inverse of the encryption function
       passed to the ForculusInserter.Insert() method.
+
+      additional_batch_decryption_func {function}: An alternative to
+      |additional_decryption_func| that decrypts many rows in one call. If this
+      is not None then it is passed lists of up to 1024 of the tuples read from
+      |e_db| and should return a list of the corresponding plain texts. At most
+      one of the two decryption functions may be given.
     """
+    if (additional_decryption_func is not None and
+        additional_batch_decryption_func is not None):
+      raise ValueError('At most one decryption function may be given.')
+    if additional_decryption_func is not None:
+      # The tuple read from e_db represents a cipher text. Pass the elements
+      # of that tuple as arguments to the decryption function receiving back
+      # the plaintext which is a single string that is a comma-separated list
+      # of fields.
+      additional_batch_decryption_func = lambda ctxts: [
+          additional_decryption_func(*ctxt) for ctxt in ctxts]
+    # The database is read twice. The first pass only counts the rows for
+    # each (iv, ctxt) pair so that the second pass needs to keep the
+    # evaluation points of just those pairs that occur at least |threshold|
+    # times. Forculus databases are typically dominated by rare values so this
+    # greatly reduces the memory used. If |e_db| cannot be rewound, or if the
+    # rows must be decrypted first, the rows are spooled to a temporary file
+    # during the first pass.
+    start = None
+    if additional_batch_decryption_func is None:
+      try:
+        start = self.e_db.tell()
+        self.e_db.seek(start)
+      except (AttributeError, IOError, OSError):
+        # |e_db| is a plain iterator, a pipe or some other stream that can not
+        # be rewound.
+        start = None
+    spool = None
+    if start is not None:
+      counts = collections.Counter((row[0], row[1]) for row in self.edb_reader)
+      self.e_db.seek(start)
+      rows = csv.reader(self.e_db)
+    else:
+      spool = tempfile.TemporaryFile()
+      spool_writer = csv.writer(spool)
+      counts = collections.Counter()
+      while True:
+        batch = list(itertools.islice(self.edb_reader, _DECRYPTION_BATCH_SIZE))
+        if not batch:
+          break
+        if additional_batch_decryption_func is not None:
+          # Each plaintext is a comma-separated list of fields. Split it into
+          # fields and use that as the value of the row.
+          batch = [ptxt.split(",")
+                   for ptxt in additional_batch_decryption_func(batch)]
+        for row in batch:
+          counts[(row[0], row[1])] += 1
+        spool_writer.writerows(batch)
+      spool.seek(0)
+      rows = csv.reader(spool)
+
+    # Maps each (iv, ctxt) pair, still base64 encoded, that occurs at least
+    # |threshold| times to a pair of parallel lists holding the evaluation
+    # points and the evaluation data, already parsed into integers.
     dictionary = {}
-    for i, row in enumerate(self.edb_reader):
-      if additional_decryption_func is not None:
-        # The tuple read from e_db represents a cipher text. Pass the elements
-        # of that tuple as arguments to the decryption function receiving
-        # back the plaintext which is a single string that is a comma-separated
-        # list of fields. Split that string into fields and use that as
-        # the value of the read row.
-        row =  additional_decryption_func(*row).split(",")
-      (iv, ctxt, eval_point, eval_data) = row
-      key = iv + " " + ctxt
-      if key in dictionary:
-        dictionary[key].append([eval_point, eval_data])
-      else:
-        dictionary[key] = [[eval_point, eval_data]]
-    _log("Dict")
-    _log(dictionary)
-    rdb_writer = csv.writer(r_db)
+    try:
+      for row in rows:
+        (iv, ctxt, eval_point, eval_data) = row
+        if counts[(iv, ctxt)] < self.threshold:
+          continue
+        points = dictionary.get((iv, ctxt))
+        if points is None:
+          points = dictionary[(iv, ctxt)] = ([], [])
+        points[0].append(int(eval_point))
+        points[1].append(int(eval_data))
+    finally:
+      if spool is not None:
+        spool.close()
+    if _LOGGING_ENABLED:
+      _log("Dict")
+      _log(dictionary)
+    if self._rdb is not r_db:
+      self._rdb = r_db
+      self._rdb_writer = csv.writer(r_db)
+    rdb_writer = self._rdb_writer
     # For each element in dict with >= self.threshold points, do
-    # Lagrange interpolation to retrieve key
-    for keys in dictionary:
-      if len(dictionary[keys]) >= self.threshold:
-        # Recover iv and ctxt first
-        [iv, ctxt] = map(base64.b64decode, keys.strip().split(" "))
-        ptxt = self._Decrypt(iv, ctxt, dictionary[keys])
-        rdb_writer.writerow([ptxt, len(dictionary[keys])])
+    # Lagrange interpolation to retrieve key. Recover iv and ctxt first.
+    tasks = [(base64.b64decode(iv), base64.b64decode(ctxt), eval_points,
+              eval_data, self.threshold, self.q)
+             for (iv, ctxt), (eval_points, eval_data) in dictionary.iteritems()
+             if len(eval_points) >= self.threshold]
+    # The decryptions are independent of each other so spread them across
+    # processes when there are enough of them. A daemonic process (such as a
+    # multiprocessing.Pool worker running a whole analyzer) is not allowed to
+    # have children so in that case the decryptions are done serially.
+    if (len(tasks) >= _MIN_PARALLEL_DECRYPTIONS and
+        multiprocessing.cpu_count() > 1 and
+        not multiprocessing.current_process().daemon):
+      pool = multiprocessing.Pool()
+      try:
+        ptxts = pool.map_async(_decrypt_task, tasks, chunksize=32).get(
+            _POOL_TIMEOUT_SECS)
+        pool.close()
+      except:
+        pool.terminate()
+        raise
+      finally:
+        pool.join()
+    else:
+      ptxts = [_decrypt_task(task) for task in tasks]
+    rdb_writer.writerows([ptxt, len(task[2])]
+                         for task, ptxt in zip(tasks, ptxts))
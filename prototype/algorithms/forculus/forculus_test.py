@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# Copyright 2016 The Fuchsia Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for forculus.py"""
+
+import csv
+import os
+import sys
+import unittest
+
+from StringIO import StringIO
+
+THIS_DIR = os.path.dirname(__file__)
+ROOT_DIR = os.path.abspath(os.path.join(THIS_DIR, os.path.pardir,
+  os.path.pardir))
+sys.path.insert(0, ROOT_DIR)
+
+import algorithms.forculus.forculus as forculus
+
+# Two entries for the plaintext "hello world" with threshold 3 written by the
+# original ForculusInserter, before the AES-CTR coefficient derivation was
+# introduced.
+_LEGACY_HELLO_WORLD_ROWS = (
+  'V+14yE4O/iH7+wmjV4A+GA==,I59kQsqu26oCWE/qOjO3GA==,'
+  '556379819315036877405171201242841010016666407186,'
+  '140478592596284923697268408008046472953888415285\r\n'
+  'V+14yE4O/iH7+wmjV4A+GA==,I59kQsqu26oCWE/qOjO3GA==,'
+  '646908342175853568909087412336978450028453836118,'
+  '1023058809134347354974963166639876833239136688434\r\n')
+
+
+def _evaluate(threshold, e_db_contents):
+  """Returns the sorted (plaintext, count) rows that a ForculusEvaluator with
+  the given threshold recovers from |e_db_contents|."""
+  r_db = StringIO()
+  evaluator = forculus.ForculusEvaluator(threshold, StringIO(e_db_contents))
+  evaluator.ComputeAndWriteResults(r_db)
+  return sorted(csv.reader(StringIO(r_db.getvalue())))
+
+
+class ForculusTest(unittest.TestCase):
+
+  def testRoundTrip(self):
+    e_db = StringIO()
+    inserter = forculus.ForculusInserter(5, e_db)
+    for ptxt in ['apple'] * 7 + ['banana'] * 5 + ['cherry'] * 4:
+      inserter.Insert(ptxt)
+    # cherry occurs fewer than |threshold| times so it can not be decrypted.
+    self.assertEqual([['apple', '7'], ['banana', '5']],
+                     _evaluate(5, e_db.getvalue()))
+
+  def testInsertManyMatchesInsert(self):
+    e_db = StringIO()
+    inserter = forculus.ForculusInserter(4, e_db)
+    inserter.InsertMany(['apple'] * 2)
+    inserter.Insert('apple')
+    inserter.InsertMany(['apple'])
+    self.assertEqual([['apple', '4']], _evaluate(4, e_db.getvalue()))
+
+  def testEvaluateFromIterator(self):
+    e_db = StringIO()
+    inserter = forculus.ForculusInserter(3, e_db)
+    inserter.InsertMany(['apple'] * 4 + ['banana'] * 2)
+    # A generator can not be rewound so the evaluator must spool its rows.
+    lines = (line for line in StringIO(e_db.getvalue()))
+    r_db = StringIO()
+    forculus.ForculusEvaluator(3, lines).ComputeAndWriteResults(r_db)
+    self.assertEqual([['apple', '4']],
+                     sorted(csv.reader(StringIO(r_db.getvalue()))))
+
+  def testLegacyCoefficientsAppendToLegacyDatabase(self):
+    e_db = StringIO()
+    e_db.write(_LEGACY_HELLO_WORLD_ROWS)
+    inserter = forculus.ForculusInserter(3, e_db, legacy_coefficients=True)
+    inserter.Insert('hello world')
+    self.assertEqual([['hello world', '3']], _evaluate(3, e_db.getvalue()))
+
+  def testNewCoefficientsDoNotMixWithLegacyDatabase(self):
+    e_db = StringIO()
+    e_db.write(_LEGACY_HELLO_WORLD_ROWS)
+    inserter = forculus.ForculusInserter(3, e_db)
+    inserter.Insert('hello world')
+    # The new entry forms its own group rather than corrupting the old one.
+    self.assertEqual([], _evaluate(3, e_db.getvalue()))
+
+
+if __name__ == '__main__':
+  unittest.main()
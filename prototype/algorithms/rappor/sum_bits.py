@@ -24,8 +24,84 @@ argument. It can be called as ./rappor_sum_bits <params file>
 import csv
 import sys
 
+# NumPy is optional. When it is available the per-cohort bit sums are
+# computed with vectorized array operations instead of a Python loop over
+# every character of every report.
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
 import third_party.rappor.client.python.rappor as rappor
 
+
+# The pure Python path keeps one running count per bit position in a lane of
+# this many hex digits inside a single integer, so the lanes overflow after
+# _LANE_CAPACITY reports and are flushed before that.
+_LANE_HEX_DIGITS = 4
+_LANE_CAPACITY = 16 ** _LANE_HEX_DIGITS - 1
+
+
+def _sumCohortBitsPython(irrs, num_bloombits):
+  """Returns the list of per-bit sums over the given IRR strings, indexed by
+  bit number, without using NumPy.
+
+  Each IRR is spread out to one hex digit per bit followed by zero padding
+  and parsed with a single int() call, so every bit lands in its own lane of
+  the accumulator. Adding these integers adds all of the bit columns at once.
+  """
+  sums = [0] * num_bloombits
+  lane_padding = '0' * (_LANE_HEX_DIGITS - 1)
+  width = _LANE_HEX_DIGITS * num_bloombits
+
+  def flush(acc):
+    digits = '%0*x' % (width, acc)
+    # Character 0 of an IRR is the highest bit, so the last lane holds bit 0.
+    for bit_num in xrange(num_bloombits):
+      end = width - bit_num * _LANE_HEX_DIGITS
+      sums[bit_num] += int(digits[end - _LANE_HEX_DIGITS:end], 16)
+
+  acc = 0
+  pending = 0
+  for irr in irrs:
+    if irr.translate(None, '01'):
+      raise RuntimeError('Invalid IRR -- digits should be 0 or 1')
+    acc += int(lane_padding.join(irr), 16)
+    pending += 1
+    if pending == _LANE_CAPACITY:
+      flush(acc)
+      acc = 0
+      pending = 0
+  if pending:
+    flush(acc)
+  return sums
+
+
+def _sumCohortBitsNumPy(irrs, num_bloombits):
+  """Returns the list of per-bit sums over the given IRR strings, indexed by
+  bit number, using NumPy."""
+  if not irrs:
+    return [0] * num_bloombits
+  # View the concatenated IRRs as a (reports x bits) matrix of the digit
+  # values. Any character other than '0' or '1' yields a value greater than
+  # one because the uint8 subtraction wraps around.
+  bits = np.frombuffer(''.join(irrs), dtype=np.uint8).reshape(
+      len(irrs), num_bloombits) - ord('0')
+  if bits.max() > 1:
+    raise RuntimeError('Invalid IRR -- digits should be 0 or 1')
+  # Character 0 is the highest bit so reverse the column sums to index them
+  # by bit number.
+  return bits.sum(axis=0, dtype=np.int64)[::-1].tolist()
+
+
+_sumCohortBits = (_sumCohortBitsPython if np is None
+                  else _sumCohortBitsNumPy)
+
+# The IRRs buffered for a cohort are summed and discarded once there are this
+# many of them, which bounds the memory used by sumBits() however large its
+# input is.
+_COHORT_BUFFER_SIZE = 65536
+
 def sumBits(params, stdin, stdout, additional_decryption_func = None,
             fields = [0, 1], header = False):
   """Sums bits from stdin to stdout with params; fields indicates which
@@ -55,6 +131,7 @@ def sumBits(params, stdin, stdout, additional_decryption_func = None,
   """
   if len(fields) != 2:
     raise RuntimeError('Error with length of fields in sumBits')
+  cohort_col, irr_col = fields
 
   csv_in = csv.reader(stdin)
   csv_out = csv.writer(stdout)
@@ -62,8 +139,19 @@ def sumBits(params, stdin, stdout, additional_decryption_func = None,
   num_cohorts = params.num_cohorts
   num_bloombits = params.num_bloombits
 
+  # The IRRs are buffered by cohort and each buffer is summed into that
+  # cohort's running totals whenever it fills up.
+  irrs_by_cohort = [[] for _ in xrange(num_cohorts)]
+  counts = [0] * num_cohorts
   sums = [[0] * num_bloombits for _ in xrange(num_cohorts)]
-  num_reports = [0] * num_cohorts
+
+  def flush(cohort):
+    irrs = irrs_by_cohort[cohort]
+    counts[cohort] += len(irrs)
+    sums[cohort] = [
+        total + bit_sum for total, bit_sum in
+        zip(sums[cohort], _sumCohortBits(irrs, num_bloombits))]
+    irrs_by_cohort[cohort] = []
 
   for i, row in enumerate(csv_in):
     if additional_decryption_func is not None:
@@ -74,33 +162,28 @@ def sumBits(params, stdin, stdout, additional_decryption_func = None,
       # the value of the read row.
       row = additional_decryption_func(*row).split(",")
 
-    subset_of_row = [row[i] for i in fields]
-    try:
-      (cohort, irr) = subset_of_row
-    except ValueError:
-      raise RuntimeError('Error parsing row %r or subset %r' % (row,
-                                                                subset_of_row))
-
     if i == 0 and header == True:
       continue  # skip header
 
+    try:
+      cohort = row[cohort_col]
+      irr = row[irr_col]
+    except IndexError:
+      raise RuntimeError('Error parsing row %r for fields %r' % (row, fields))
+
     cohort = int(cohort)
-    num_reports[cohort] += 1
 
     if not len(irr) == params.num_bloombits:
       raise RuntimeError(
           "Expected %d bits, got %r" % (params.num_bloombits, len(irr)))
-    for i, c in enumerate(irr):
-      bit_num = num_bloombits - i - 1  # e.g. char 0 = bit 15, char 15 = bit 0
-      if c == '1':
-        sums[cohort][bit_num] += 1
-      else:
-        if c != '0':
-          raise RuntimeError('Invalid IRR -- digits should be 0 or 1')
+    irrs_by_cohort[cohort].append(irr)
+    if len(irrs_by_cohort[cohort]) == _COHORT_BUFFER_SIZE:
+      flush(cohort)
 
   for cohort in xrange(num_cohorts):
+    flush(cohort)
     # First column is the total number of reports in the cohort.
-    row = [num_reports[cohort]] + sums[cohort]
+    row = [counts[cohort]] + sums[cohort]
     csv_out.writerow(row)
 
 
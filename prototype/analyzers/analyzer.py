@@ -17,8 +17,11 @@
 all analyzers.
 """
 
+import collections
 import csv
+import hashlib
 import logging
+import multiprocessing
 import os
 import shutil
 import subprocess
@@ -30,6 +33,17 @@ sys.path.insert(0, ROOT_DIR)
 THIRD_PARTY_DIR = os.path.join(ROOT_DIR, "third_party")
 ALGORITHMS_DIR = os.path.join(ROOT_DIR, "algorithms")
 
+# The RAPPOR repository, passed to the R scripts in the RAPPOR_REPO environment
+# variable, the R scripts themselves and the fast_em executable used by the
+# correlation analysis.
+RAPPOR_REPO_DIR = os.path.join(THIRD_PARTY_DIR, 'rappor/')
+RAPPOR_DECODE_SCRIPT = os.path.join(THIRD_PARTY_DIR,
+    'rappor', 'bin', 'decode_dist.R')
+RAPPOR_AVG_DECODE_SCRIPT = os.path.join(ALGORITHMS_DIR,
+    'rappor', 'decode_assoc_averages.R')
+EM_EXECUTABLE_FILE = os.path.abspath(os.path.join(THIRD_PARTY_DIR,
+    'rappor', 'analysis', 'cpp', '_tmp', 'fast_em'))
+
 import algorithms.forculus.forculus as forculus
 import algorithms.laplace.laplacian as laplacian
 import algorithms.rappor.sum_bits as sum_bits
@@ -50,6 +64,26 @@ _logger = logging.getLogger()
 # Randomizers and the Analyzers via the Shufflers?
 _use_public_key_encryption=False
 
+# A cache of parsed RAPPOR config params keyed by the path, modified time and
+# size of the config file. See _readRapporParams().
+_rappor_params_cache = {}
+
+# A cache of the SHA-256 digests of RAPPOR candidate files keyed in the same
+# way. See _generateMapFileIfNecessary().
+_candidates_digest_cache = {}
+
+def _fileCacheKey(path):
+  ''' Returns a key for caching data derived from the file at |path|. The key
+  changes whenever the file is modified.
+  '''
+  st = os.stat(path)
+  return (path, st.st_mtime, st.st_size)
+
+# At most the last _R_OUTPUT_TAIL_CHUNKS * _R_OUTPUT_CHUNK_SIZE bytes of the
+# output of a RAPPOR decode script are kept to be printed if the script fails.
+_R_OUTPUT_CHUNK_SIZE = 4096
+_R_OUTPUT_TAIL_CHUNKS = 16
+
 def analyzeUsingForculus(input_file, config_file, output_file):
   ''' A helper function that may be invoked by individual analyzers. It reads
   input data in the form of a CSV file (that is generated as output from the
@@ -76,13 +110,13 @@ def analyzeUsingForculus(input_file, config_file, output_file):
   decrypt_on_analyzer=None
   if _use_public_key_encryption:
     ch = crypto_helper.CryptoHelper()
-    decrypt_on_analyzer=ch.decryptOnAnalyzer
+    decrypt_on_analyzer=ch.decryptManyOnAnalyzer
 
   with file_util.openForAnalyzerReading(input_file) as input_f:
     with file_util.openForWriting(output_file) as output_f:
       forculus_evaluator = forculus.ForculusEvaluator(config.threshold, input_f)
       forculus_evaluator.ComputeAndWriteResults(output_f,
-          additional_decryption_func=decrypt_on_analyzer)
+          additional_batch_decryption_func=decrypt_on_analyzer)
 
 def analyzeUsingRAPPOR(input_file, config_file, output_file,
                        metric_name="metric",
@@ -154,9 +188,12 @@ def analyzeUsingRAPPOR(input_file, config_file, output_file,
           correlation configuration parameters.
   '''
   # First get the RAPPOR config params.
-  with file_util.openFileForReading(
-    config_file, file_util.CONFIG_DIR) as cf:
-    config_params = rappor.Params.from_csv(cf)
+  config_params = _readRapporParams(config_file)
+
+  # Each analysis gets its own directory for the output of the R script so
+  # that analyses running concurrently do not overwrite each other's results.
+  rappor_out_dir = os.path.join(file_util.ANALYZER_TMP_OUT_DIR, metric_name)
+  file_util.ensureDir(rappor_out_dir)
 
   map_file_prefix = metric_name
   if assoc_options is not None:
@@ -170,19 +207,37 @@ def analyzeUsingRAPPOR(input_file, config_file, output_file,
   if use_basic_rappor:
     # Because we are using basic RAPPOR the map file is a static file in the
     # config directory--we do not have to generate a map file from a candidate
-    # file. But we copy it into the cache directory because the R script will
-    # write a .rda file in the same directory and we don't want it to write
-    # into the config directory.
+    # file. But we link to it from the cache directory because the R script
+    # will write a .rda file in the same directory and we don't want it to
+    # write into the config directory.
     assert basic_map_file_name is not None
     assert candidates_file_name is None
     basic_map_file = os.path.join(file_util.CONFIG_DIR, basic_map_file_name)
-    _copyFileIfNecessary(basic_map_file, map_file)
+    _linkFileIfNecessary(basic_map_file, map_file)
   else:
     assert basic_map_file_name is None
     assert candidates_file_name is not None
     _generateMapFileIfNecessary(map_file, map_file_name, candidates_file_name,
         config_params)
 
+  # The output depends only on the contents of the input file, the config
+  # files and the map file, and on the options of this analysis. A hash of
+  # these is recorded in a stamp file when the output is written and the
+  # analysis is skipped if the stamp still matches.
+  stamp_paths = [os.path.join(file_util.S_TO_A_DIR, input_file),
+                 os.path.join(file_util.CONFIG_DIR, config_file), map_file]
+  if assoc_options is not None:
+    stamp_paths.extend(_assocConfigPaths(assoc_options))
+  stamp = _hashFiles(stamp_paths) + repr((metric_name, assoc_options,
+      use_basic_rappor, for_private_release, _use_public_key_encryption))
+  output_stamp_file = os.path.join(file_util.ANALYZER_TMP_OUT_DIR,
+                                   output_file + '.stamp')
+  if (os.path.exists(os.path.join(file_util.OUT_DIR, output_file)) and
+      _readStamp(output_stamp_file) == stamp):
+    _logger.debug('Skipping the RAPPOR analysis of %s since its inputs '
+                  'have not changed' % input_file)
+    return
+
   # Decrypt the input file contents from shuffler if necessary.
   decrypt_on_analyzer=None
   if _use_public_key_encryption:
@@ -197,7 +252,8 @@ def analyzeUsingRAPPOR(input_file, config_file, output_file,
     with file_util.openForAnalyzerReading(input_file) as input_f:
       with file_util.openForAnalyzerTempWriting(counts_file_name) as output_f:
         sum_bits.sumBits(config_params, input_f, output_f, decrypt_on_analyzer)
-    cmd = _buildRAPPORAnalysisCmd(counts_file_name, config_file, map_file)
+    cmd = _buildRAPPORAnalysisCmd(counts_file_name, config_file, map_file,
+                                  rappor_out_dir)
   else:
     # Use correlation based RAPPOR analysis
     if decrypt_on_analyzer is not None:
@@ -227,35 +283,44 @@ def analyzeUsingRAPPOR(input_file, config_file, output_file,
         map_file,
         reports_file,
         assoc_options['metric_name'],
-        assoc_options['vars'])
-
-  # Then we change into the Rappor directory and execute the command.
-  savedir = os.getcwd()
-  os.chdir(ALGORITHMS_DIR)
-  os.environ["RAPPOR_REPO"] = os.path.join(THIRD_PARTY_DIR, 'rappor/')
-
-  # We supress the output from the R script unless it fails.
-  try:
-    subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-  except subprocess.CalledProcessError as e:
+        assoc_options['vars'],
+        rappor_out_dir)
+
+  # Then we execute the command in the Rappor directory. The working
+  # directory and the environment are passed to the subprocess rather than
+  # changed in this process so that analyses may run concurrently.
+  env = dict(os.environ)
+  env["RAPPOR_REPO"] = RAPPOR_REPO_DIR
+
+  # We supress the output from the R script unless it fails. The output is
+  # drained as it is produced and only the tail of it is kept.
+  p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                       cwd=ALGORITHMS_DIR, env=env)
+  output_tail = collections.deque(maxlen=_R_OUTPUT_TAIL_CHUNKS)
+  for chunk in iter(lambda: p.stdout.read(_R_OUTPUT_CHUNK_SIZE), ''):
+    output_tail.append(chunk)
+  if p.wait() != 0:
     print "\n**** Error running RAPPOR decode script:"
-    print e.output
+    print ''.join(output_tail)
     raise Exception('Fatal error. Cobalt pipeline terminating.')
-  os.chdir(savedir)
 
   if assoc_options or use_basic_rappor or for_private_release == False:
-    # Simply copy the results file to the out directory and return.
+    # Simply move the results file to the out directory and return. If both
+    # directories are on the same file system a rename suffices, otherwise
+    # the file is copied.
     results_file_name = 'assoc-results.csv' if assoc_options else 'results.csv'
-    src = os.path.abspath(os.path.join(
-        file_util.ANALYZER_TMP_OUT_DIR, results_file_name))
+    src = os.path.abspath(os.path.join(rappor_out_dir, results_file_name))
     dst = os.path.abspath(os.path.join(
         file_util.OUT_DIR, output_file))
-    shutil.copyfile(src, dst)
+    if os.stat(src).st_dev == os.stat(file_util.OUT_DIR).st_dev:
+      os.rename(src, dst)
+    else:
+      shutil.copyfile(src, dst)
+    _writeStamp(output_stamp_file, stamp)
     return
 
   # Read in the results of the RAPPOR analysis
-  with file_util.openFileForReading('results.csv',
-      file_util.ANALYZER_TMP_OUT_DIR) as f:
+  with file_util.openFileForReading('results.csv', rappor_out_dir) as f:
     reader = csv.reader(f)
     results = [result for result in reader]
 
@@ -276,9 +341,65 @@ def analyzeUsingRAPPOR(input_file, config_file, output_file,
     writer = csv.writer(f)
     for result in results:
       writer.writerow(result)
+  _writeStamp(output_stamp_file, stamp)
+
+def _assocConfigPaths(assoc_options):
+  ''' Returns the paths of the correlation config file given in
+  |assoc_options| and of the RAPPOR params files it names for the metric.
+  '''
+  assoc_config_file = os.path.join(file_util.CONFIG_DIR,
+                                   assoc_options['config_file'])
+  paths = [assoc_config_file]
+  with open(assoc_config_file, 'rb') as f:
+    for row in csv.DictReader(f):
+      if row['metric'] == assoc_options['metric_name']:
+        paths.append(os.path.join(file_util.CONFIG_DIR, row['params'] + '.csv'))
+  return paths
+
+def _hashFiles(paths):
+  ''' Returns the hex SHA-256 digest of the concatenated contents of the
+  files at |paths|.
+  '''
+  h = hashlib.sha256()
+  for path in paths:
+    with open(path, 'rb') as f:
+      for chunk in iter(lambda: f.read(1 << 20), ''):
+        h.update(chunk)
+  return h.hexdigest()
+
+def _readStamp(stamp_file):
+  ''' Returns the contents of |stamp_file| or None if it cannot be read.
+  '''
+  try:
+    with open(stamp_file, 'rb') as f:
+      return f.read()
+  except IOError:
+    return None
+
+def _writeStamp(stamp_file, stamp):
+  ''' Writes |stamp| to |stamp_file|. The stamp is written to a temporary
+  file and renamed into place so that a partially written stamp is never
+  seen.
+  '''
+  tmp_stamp_file = stamp_file + '.tmp'
+  with open(tmp_stamp_file, 'wb') as f:
+    f.write(stamp)
+  os.rename(tmp_stamp_file, stamp_file)
+
+def _readRapporParams(config_file):
+  ''' Returns the RAPPOR config params specified by the config file with
+  simple name |config_file| in the config directory. The parsed params are
+  cached and are only parsed again if the config file has been modified.
+  '''
+  key = _fileCacheKey(os.path.join(file_util.CONFIG_DIR, config_file))
+  if key not in _rappor_params_cache:
+    with file_util.openFileForReading(
+      config_file, file_util.CONFIG_DIR) as cf:
+      _rappor_params_cache[key] = rappor.Params.from_csv(cf)
+  return _rappor_params_cache[key]
 
 def _buildRAPPORCorrelationAnalysisCmd(assoc_config_file, map1_file,
-    reports_file, metric_name, vars):
+    reports_file, metric_name, vars, output_dir):
   ''' Invoke the R script 'decode_assoc_averages.R' for running correlation
       analysis using multiple params.
   '''
@@ -286,24 +407,17 @@ def _buildRAPPORCorrelationAnalysisCmd(assoc_config_file, map1_file,
   file_util.ensureDir(file_util.ANALYZER_TMP_OUT_DIR)
 
   # First we build the command string.
-  rappor_avg_decode_script = os.path.join(ALGORITHMS_DIR,
-      'rappor', 'decode_assoc_averages.R')
-  schema_file = os.path.abspath(os.path.join(
-                file_util.CONFIG_DIR,
-                assoc_config_file))
-
-  em_executable_file = os.path.abspath(os.path.join(THIRD_PARTY_DIR,
-                                       'rappor', 'analysis',
-                                       'cpp', '_tmp', 'fast_em'))
-  if os.path.isfile(em_executable_file) == False:
-    exception_str = 'Expect fast_em executable at %s.' % em_executable_file
+  schema_file = os.path.join(file_util.CONFIG_DIR, assoc_config_file)
+
+  if os.path.isfile(EM_EXECUTABLE_FILE) == False:
+    exception_str = 'Expect fast_em executable at %s.' % EM_EXECUTABLE_FILE
     exception_str += (' Terminating Correlations Analyzer.'
                       ' Please run ./cobalt.py build to build'
                       ' fast_em executable.\n')
 
     raise Exception('\n****' + exception_str)
 
-  cmd = [rappor_avg_decode_script,
+  cmd = [RAPPOR_AVG_DECODE_SCRIPT,
          '--metric-name', metric_name,
          '--schema', schema_file,
          '--reports', reports_file,
@@ -314,21 +428,18 @@ def _buildRAPPORCorrelationAnalysisCmd(assoc_config_file, map1_file,
          '--create-cat-map',
          '--max-em-iters', "1000",
          '--num-cores', "2",
-         '--output-dir', file_util.ANALYZER_TMP_OUT_DIR,
-         '--em-executable', em_executable_file
+         '--output-dir', output_dir,
+         '--em-executable', EM_EXECUTABLE_FILE
          ]
   return cmd
 
-def _buildRAPPORAnalysisCmd(counts_file_name, config_file, map_file):
-  rappor_decode_script = os.path.join(THIRD_PARTY_DIR,
-      'rappor', 'bin', 'decode_dist.R')
-  counts_file = os.path.abspath(os.path.join(file_util.ANALYZER_TMP_OUT_DIR,
-      counts_file_name))
-  params_file =  os.path.abspath(os.path.join(file_util.CONFIG_DIR,
-      config_file))
-  cmd = [rappor_decode_script, '--map', map_file, '--counts', counts_file,
-         '--params', params_file, '--output-dir',
-         file_util.ANALYZER_TMP_OUT_DIR]
+def _buildRAPPORAnalysisCmd(counts_file_name, config_file, map_file,
+                            output_dir):
+  # The directories in file_util are already absolute paths.
+  counts_file = os.path.join(file_util.ANALYZER_TMP_OUT_DIR, counts_file_name)
+  params_file = os.path.join(file_util.CONFIG_DIR, config_file)
+  cmd = [RAPPOR_DECODE_SCRIPT, '--map', map_file, '--counts', counts_file,
+         '--params', params_file, '--output-dir', output_dir]
   return cmd
 
 def _generateMapFileIfNecessary(map_file, map_file_name, candidates_file_name,
@@ -338,28 +449,51 @@ def _generateMapFileIfNecessary(map_file, map_file_name, candidates_file_name,
   '''
   candidate_file = os.path.join(file_util.CONFIG_DIR, candidates_file_name)
 
-  # Generate the map file unless it already exists and has a modified
-  # timestamp later than that of the candidate file. We allow a buffer of
-  # 10 seconds in case the timestamps are out of sync for some reason.
-  if (not os.path.exists(map_file) or
-      os.path.getmtime(map_file) < os.path.getmtime(candidate_file) + 10):
+  # The map file is a function of the contents of the candidate file and of
+  # the RAPPOR params. We record a hash of both in a stamp file next to the
+  # map file and only regenerate the map file if the stamp does not match.
+  key = _fileCacheKey(candidate_file)
+  if key not in _candidates_digest_cache:
     with file_util.openFileForReading(candidates_file_name,
         file_util.CONFIG_DIR) as cand_f:
-      with file_util.openFileForWriting(map_file_name,
-          file_util.CACHE_DIR) as map_f:
-        _logger.debug('Generating a RAPPOR map file at %s based on '
-                      'candidate file at %s' % (map_file, candidate_file))
-        hash_candidates.HashCandidates(params, cand_f, map_f)
-
-def _copyFileIfNecessary(from_file, to_file):
-  ''' Copies from_file to to_file if from_file has been modified more
-  recently than to_file.
-  '''
-  if (not os.path.exists(to_file) or
-      os.path.getmtime(to_file) < os.path.getmtime(from_file) + 10):
-    shutil.copyfile(from_file, to_file)
+      _candidates_digest_cache[key] = hashlib.sha256(cand_f.read()).hexdigest()
+  stamp = _candidates_digest_cache[key] + repr(params)
+  stamp_file = map_file + '.stamp'
+  if os.path.exists(map_file) and _readStamp(stamp_file) == stamp:
+    return
 
-def runAllAnalyzers(use_public_key_encryption=False):
+  with file_util.openFileForReading(candidates_file_name,
+      file_util.CONFIG_DIR) as cand_f:
+    with file_util.openFileForWriting(map_file_name,
+        file_util.CACHE_DIR) as map_f:
+      _logger.debug('Generating a RAPPOR map file at %s based on '
+                    'candidate file at %s' % (map_file, candidate_file))
+      hash_candidates.HashCandidates(params, cand_f, map_f)
+  _writeStamp(stamp_file, stamp)
+
+def _linkFileIfNecessary(from_file, to_file):
+  ''' Makes to_file a symbolic link to from_file unless it already is one.
+  Any other file at to_file, such as a copy made by an earlier version of this
+  script, is replaced.
+  '''
+  try:
+    if os.readlink(to_file) == from_file:
+      return
+  except OSError:
+    pass
+  if os.path.lexists(to_file):
+    os.remove(to_file)
+  os.symlink(from_file, to_file)
+
+# By default runAllAnalyzers() runs at most this many analyzers at once, and
+# no more than there are CPUs.
+_DEFAULT_MAX_ANALYZERS = 4
+
+# The analyzer results are waited on with this timeout, because in Python 2 a
+# wait without one can not be interrupted with Ctrl-C.
+_POOL_TIMEOUT_SECS = 7 * 24 * 60 * 60
+
+def runAllAnalyzers(use_public_key_encryption=False, max_workers=None):
   """Runs all of the analyzers.
 
   This function does not return anything but it invokes all of the
@@ -370,19 +504,53 @@ def runAllAnalyzers(use_public_key_encryption=False):
     use_public_key_encryption {boolean}: Should public key encrytpion be
     used to encrypt communication between the Randomizers and the Analyzers
     via the shufflers?
+
+    max_workers {int}: The maximum number of analyzers to run at the same
+    time. If this is None then min(number of CPUs, 4) is used.
   """
 
   global _use_public_key_encryption
   _use_public_key_encryption = use_public_key_encryption
 
+  # The analyzers read and write distinct files so they are run concurrently
+  # in a pool of worker processes. Each analyzer generates its map file and
+  # then runs its decode script within a single task so that the hashing of
+  # one analyzer overlaps with the decoding of the others. The results are
+  # waited for in order so that an exception raised by an analyzer is
+  # re-raised here. The shared temporary directory is created up front so the
+  # workers do not race on it.
+  file_util.ensureDir(file_util.ANALYZER_TMP_OUT_DIR)
+  if max_workers is None:
+    max_workers = min(multiprocessing.cpu_count(), _DEFAULT_MAX_ANALYZERS)
+  pool = multiprocessing.Pool(min(max_workers, len(_ANALYZER_TASKS)))
+  try:
+    results = [pool.apply_async(task) for task in _ANALYZER_TASKS]
+    for result in results:
+      result.get(_POOL_TIMEOUT_SECS)
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+
+# The functions below are the units of work that runAllAnalyzers() runs
+# concurrently. They are defined at module level so that they can be sent to
+# worker processes.
+
+def _runHelpQueryAnalyzer():
   print "Running the help-query analyzer..."
   hq_analyzer = help_query_analyzer.HelpQueryAnalyzer()
   hq_analyzer.analyze()
 
+def _runCityRatingsAnalyzer():
   print "Running the city/ratings analyzer..."
   cr_analyzer = city_analyzer.CityRatingsAnalyzer()
   cr_analyzer.analyze()
 
+def _runModuleNameAnalyzers():
+  # The two module name analyses share a map file so they are run one after
+  # the other.
   print "Running the module names analyzer..."
   mn_analyzer = module_name_analyzer.ModuleNameAnalyzer()
   mn_analyzer.analyze()
@@ -391,14 +559,24 @@ def runAllAnalyzers(use_public_key_encryption=False):
         "release...")
   mn_analyzer.analyze(for_private_release=True)
 
+def _runHourOfDayAnalyzer():
   print "Running the hour-of-day analyzer..."
   hd_analyzer = hour_analyzer.HourOfDayAnalyzer()
   hd_analyzer.analyze()
 
+def _runUrlAnalyzer():
   print "Running the url analyzer..."
   u_analyzer = url_analyzer.UrlAnalyzer()
   u_analyzer.analyze()
 
+_ANALYZER_TASKS = [
+  _runHelpQueryAnalyzer,
+  _runCityRatingsAnalyzer,
+  _runModuleNameAnalyzers,
+  _runHourOfDayAnalyzer,
+  _runUrlAnalyzer,
+]
+
 def main():
   runAllAnalyzers()
 
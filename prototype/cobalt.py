@@ -15,12 +15,15 @@
 
 """The Cobalt command-line interface."""
 
+from __future__ import print_function
+
 import argparse
 import logging
 import os
 import shutil
 import subprocess
 import sys
+import threading
 
 import analyzers.analyzer as analyzer
 import fake_data.generate_fake_data as fake_data
@@ -34,6 +37,10 @@ THIS_DIR = os.path.dirname(__file__)
 
 _logger = logging.getLogger()
 _verbose_count = 0
+_logging_initialized = False
+
+# The argument parser. It is built on first use by _getParser().
+_parser = None
 
 # Should public key encryption be used for communication between the
 # Randomizers and the Analyzers via the Shufflers?
@@ -50,7 +57,11 @@ def _initLogging(verbose_count):
     level = logging.INFO
   else:  # verbose_count >= 2
     level = logging.DEBUG
-  logging.basicConfig(format="%(relativeCreated).3f:%(levelname)s:%(message)s")
+  global _logging_initialized
+  if not _logging_initialized:
+    logging.basicConfig(
+        format="%(relativeCreated).3f:%(levelname)s:%(message)s")
+    _logging_initialized = True
   logger = logging.getLogger()
   logger.setLevel(level)
   logger.debug("Initialized logging: verbose_count=%d, level=%d" %
@@ -58,17 +69,13 @@ def _initLogging(verbose_count):
   logger.debug("_use_public_key_encryption=%s" % _use_public_key_encryption)
 
 def _build_fastrand():
-  savedir = os.getcwd()
-  os.chdir(os.path.join(THIS_DIR, 'third_party', 'fastrand'))
-  subprocess.call(['./build.sh'])
-  os.chdir(savedir)
+  subprocess.call(['./build.sh'],
+                  cwd=os.path.join(THIS_DIR, 'third_party', 'fastrand'))
 
 def _build_fastem():
-  savedir = os.getcwd()
-  os.chdir(os.path.join(THIS_DIR, 'third_party', 'rappor', 'analysis',
-                        'cpp'))
-  subprocess.call(['./run.sh', 'build-fast-em'])
-  os.chdir(savedir)
+  subprocess.call(['./run.sh', 'build-fast-em'],
+                  cwd=os.path.join(THIS_DIR, 'third_party', 'rappor',
+                                   'analysis', 'cpp'))
 
 def _build():
   _build_fastrand()
@@ -82,8 +89,18 @@ def _test():
   _run_end_to_end_test()
 
 def _clean_all():
-  print "Deleting the out directory..."
-  shutil.rmtree(file_util.OUT_DIR, ignore_errors=True)
+  _logger.info("Deleting the out directory...")
+  # Move the out directory out of the way and delete it in the background so
+  # that the rest of the pipeline does not wait for the deletion. The thread
+  # is not a daemon so the process still waits for it before exiting.
+  trash_dir = '%s.trash.%d' % (file_util.OUT_DIR, os.getpid())
+  try:
+    os.rename(file_util.OUT_DIR, trash_dir)
+  except OSError:
+    shutil.rmtree(file_util.OUT_DIR, ignore_errors=True)
+    return
+  threading.Thread(target=shutil.rmtree, args=(trash_dir,),
+                   kwargs={'ignore_errors': True}).start()
 
 def _generate():
   # Generates fake data and runs the straight-counting pipeline
@@ -112,9 +129,15 @@ def _run_all():
   _shuffle()
   _analyze()
   _visualize()
-  print "Done."
+  print("Done.")
+
+def _getParser():
+  """Returns the argument parser for the command line, building it the first
+  time this is called."""
+  global _parser
+  if _parser is not None:
+    return _parser
 
-def main():
   parser = argparse.ArgumentParser(description='The Cobalt command-line '
       'interface.')
 
@@ -198,7 +221,11 @@ def main():
     help='Generates the visualization data from Cobalt prototype pipeline.')
   sub_parser.set_defaults(func=_visualize)
 
-  args = parser.parse_args()
+  _parser = parser
+  return _parser
+
+def main():
+  args = _getParser().parse_args()
   global _verbose_count
   _verbose_count = args.verbose_count
   global _use_public_key_encryption
@@ -251,9 +251,8 @@ def randomizeUsingForculus(entries, param_index, config_file, output_file):
 
   with file_util.openForRandomizerWriting(output_file) as f:
     forculus_inserter = forculus.ForculusInserter(config.threshold, f)
-    for entry in entries:
-      forculus_inserter.Insert(entry[param_index],
-          additional_encryption_func=encrypt_for_analyzer)
+    forculus_inserter.InsertMany((entry[param_index] for entry in entries),
+        additional_encryption_func=encrypt_for_analyzer)
 
 def runAllRandomizers(entries, use_public_key_encryption=False):
   '''Runs all of the randomizers on the given list of entries.
@@ -19,6 +19,7 @@ This file also contains utilities common to all shufflers.
 """
 
 import csv
+import multiprocessing
 import os
 import random
 import sys
@@ -123,6 +124,10 @@ def shuffleCSVFiles(input_file, output_file):
     for entry in entries:
       writer.writerow(entry)
 
+# How long runAllShufflers() waits for a shuffler. It is only there because
+# Python 2 ignores Ctrl-C during a wait on a result that has no timeout.
+_POOL_TIMEOUT_SECS = 7 * 24 * 60 * 60
+
 def runAllShufflers():
   """Runs all of the shufflers.
 
@@ -130,29 +135,66 @@ def runAllShufflers():
   shufflers each of which will read a file from the 'r_to_s' directory
   and write a file into the 's_to_a' output directory.
   """
+  # The shufflers read and write distinct files so they are run concurrently,
+  # each in its own worker process. Each worker reseeds the random module so
+  # that the workers do not all make the same permutations. The results are
+  # waited for in order so that an exception raised by a shuffler is
+  # re-raised here.
+  pool = multiprocessing.Pool(len(_SHUFFLER_TASKS), initializer=random.seed)
+  try:
+    results = [pool.apply_async(task) for task in _SHUFFLER_TASKS]
+    for result in results:
+      result.get(_POOL_TIMEOUT_SECS)
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+
+# The functions below are the units of work that runAllShufflers() runs
+# concurrently. They are defined at module level so that they can be sent to
+# worker processes.
+
+def _runHelpQueryShuffler():
   print "Running the help-query shuffler..."
   hq_shuffler = help_query_shuffler.HelpQueryShuffler()
   hq_shuffler.shuffle()
 
+def _runCityShuffler():
   print "Running the city shuffler..."
   ct_shuffler = city_shuffler.CityShuffler()
   ct_shuffler.shuffle()
 
+def _runModuleNameShuffler():
   print "Running the module name shuffler..."
   mn_shuffler = module_name_shuffler.ModuleNameShuffler()
   mn_shuffler.shuffle()
 
+def _runModuleNamePrivateReleaseShuffler():
   print "Running the module name shuffler for differentially private release..."
+  mn_shuffler = module_name_shuffler.ModuleNameShuffler()
   mn_shuffler.shuffle(for_private_release=True)
 
+def _runHourOfDayShuffler():
   print "Running the hour-of-day shuffler..."
   hr_shuffler = hour_shuffler.HourShuffler()
   hr_shuffler.shuffle()
 
+def _runUrlShuffler():
   print "Running the url shuffler..."
   u_shuffler = url_shuffler.UrlShuffler()
   u_shuffler.shuffle()
 
+_SHUFFLER_TASKS = [
+  _runHelpQueryShuffler,
+  _runCityShuffler,
+  _runModuleNameShuffler,
+  _runModuleNamePrivateReleaseShuffler,
+  _runHourOfDayShuffler,
+  _runUrlShuffler,
+]
+
 def main():
   runAllShufflers()
 
@@ -19,26 +19,71 @@ Given a list of candidates on stdin, produce a file of hashes ("map file").
 """
 
 import csv
+import hashlib
+import itertools
 import sys
 
+# NumPy is optional. When it is available the digests of a batch of
+# candidates are turned into map file columns with array operations.
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
 import third_party.rappor.client.python.rappor as rappor
 
 
+# The number of candidates whose digests are computed and converted at a time
+# when NumPy is available.
+_BATCH_SIZE = 1024
+
+
 def HashCandidates(params, stdin, stdout):
   num_bloombits = params.num_bloombits
+  num_hashes = params.num_hashes
+  num_cohorts = params.num_cohorts
   csv_out = csv.writer(stdout)
 
+  # This inlines rappor.get_bloom_bits(). The 4 byte cohort prefix of the
+  # hashed value and the offset of the cohort's bits in the map file row are
+  # computed once rather than once per candidate.
+  cohorts = [(rappor.to_big_endian(cohort), cohort * num_bloombits + 1)
+             for cohort in xrange(num_cohorts)]
+  md5 = hashlib.md5
+  digest_size = md5().digest_size
+  if num_hashes > digest_size:
+    raise RuntimeError("Can't have more than %d hashes" % digest_size)
+
+  if np is not None:
+    prefixes = [prefix for prefix, _ in cohorts]
+    offsets = np.array([offset for _, offset in cohorts])[None, :, None]
+    words = (line.strip() for line in stdin)
+    while True:
+      batch = list(itertools.islice(words, _BATCH_SIZE))
+      if not batch:
+        break
+      # View the digests of the batch as a (candidates x cohorts x bytes)
+      # array and keep the first |num_hashes| bytes of each digest.
+      digests = np.frombuffer(
+          ''.join([md5(prefix + word).digest()
+                   for word in batch for prefix in prefixes]),
+          dtype=np.uint8).reshape(len(batch), num_cohorts, digest_size)
+      bits = digests[:, :, :num_hashes] % num_bloombits + offsets
+      csv_out.writerows(
+          [word] + row for word, row in
+          zip(batch, bits.reshape(len(batch), -1).tolist()))
+    return
+
   for line in stdin:
     word = line.strip()
     row = [word]
-    for cohort in xrange(params.num_cohorts):
-      bloom_bits = rappor.get_bloom_bits(word, cohort, params.num_hashes,
-                                         num_bloombits)
-      for bit_to_set in bloom_bits:
-        # bits are indexed from 1.  Add a fixed offset for each cohort.
-        # NOTE: This detail could be omitted from the map file format, and done
-        # in R.
-        row.append(cohort * num_bloombits + (bit_to_set + 1))
+    for prefix, offset in cohorts:
+      digest = md5(prefix + word).digest()
+      # bits are indexed from 1.  Add a fixed offset for each cohort.
+      # NOTE: This detail could be omitted from the map file format, and done
+      # in R.
+      row.extend([offset + ord(byte) % num_bloombits
+                  for byte in digest[:num_hashes]])
     csv_out.writerow(row)
 
 
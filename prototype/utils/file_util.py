@@ -148,8 +148,14 @@ def ensureDir(dir_path):
     dir_path{string} The path to a directory. If it does not exist it will be
     created.
   """
+  # Another process may create the directory concurrently so it is not an
+  # error if it exists by the time makedirs() runs.
   if not os.path.exists(dir_path):
-    os.makedirs(dir_path)
+    try:
+      os.makedirs(dir_path)
+    except OSError:
+      if not os.path.isdir(dir_path):
+        raise
 
 def openFileForWriting(file_name, dir_path):
   # Create the directory if it does not exist.
@@ -25,16 +25,27 @@ readonly GCLOUD_DIR="${PREFIX}/gcloud"
 export PATH="${PREFIX}/bin:${GCLOUD_DIR}/google-cloud-sdk/bin:${PATH}"
 export LD_LIBRARY_PATH="${PREFIX}/lib"
 
+SYSROOT_ONLY=false
+SKIP_SYSROOT=false
+
 # Main entry point.
-while getopts "eh" o; do
+while getopts "ehcs" o; do
     case "${o}" in
       e)
         exec /bin/bash
         ;;
+      c)
+        SYSROOT_ONLY=true
+        ;;
+      s)
+        SKIP_SYSROOT=true
+        ;;
       h)
         echo "Usage: $0 <opts>"
         echo "-h    help"
         echo "-e    launch a shell with PATHs set"
+        echo "-c    only install the sysroot packages"
+        echo "-s    skip installing the sysroot packages"
         exit 0
         ;;
       *)
@@ -42,7 +53,14 @@ while getopts "eh" o; do
     esac
 done
 
-${SCRIPT_DIR}/cipd ensure -ensure-file cobalt.ensure -root sysroot
+# The sysroot packages do not depend on the git submodules so this step may run
+# while they are being fetched.
+if [[ "${SKIP_SYSROOT}" != true ]]; then
+  ${SCRIPT_DIR}/cipd ensure -ensure-file cobalt.ensure -root sysroot
+fi
+if [[ "${SYSROOT_ONLY}" == true ]]; then
+  exit 0
+fi
 
 # Build and install protoc-gen-go binary
 export GOROOT="${PREFIX}/golang"
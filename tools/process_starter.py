@@ -18,6 +18,7 @@
 import os
 import shutil
 import subprocess
+import sys
 
 THIS_DIR = os.path.dirname(__file__)
 SRC_ROOT_DIR = os.path.abspath(os.path.join(THIS_DIR, os.pardir))
@@ -77,7 +78,7 @@ def kill_process(process, name):
     process.wait()
 
 
-def execute_command(cmd, wait):
+def execute_command(cmd, wait, replace_process=False):
   """ Executes the given command and optionally waits for it to complete.
 
   command {list of strings} will be passed to Popen().
@@ -86,10 +87,20 @@ def execute_command(cmd, wait):
       the result code. If false we will return immediately and return an
       instance of Popen.
 
+  replace_process {bool} If true the command replaces the current process
+      via os.execv() instead of being run as a child of it, and this function
+      does not return. |wait| is ignored. Use this when there is nothing
+      left to do after the command exits.
+
   Returns:
     An instance of Popen if wait is false or an integer return code if
     wait is true.
   """
+  if replace_process:
+    # Anything still buffered would be lost by execv().
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execv(cmd[0], cmd)
   p = subprocess.Popen(cmd)
   if not wait:
     return p
@@ -99,7 +110,7 @@ def execute_command(cmd, wait):
     print "****** WARNING Process [%s] terminated by signal %d" % (cmd[0], - return_code)
   return return_code
 
-def start_bigtable_emulator(wait=True):
+def start_bigtable_emulator(wait=True, replace_process=False):
   # Note(rudominer) We can pass -port=n to cbtemulator to run on a different
   # port.
   print
@@ -108,7 +119,7 @@ def start_bigtable_emulator(wait=True):
   path = os.path.abspath(os.path.join(SYS_ROOT_DIR, 'gcloud',
       'google-cloud-sdk', 'platform', 'bigtable-emulator', 'cbtemulator'))
   cmd = [path]
-  return execute_command(cmd, wait)
+  return execute_command(cmd, wait, replace_process)
 
 SHUFFLER_PATH = os.path.abspath(os.path.join(OUT_DIR, 'shuffler', 'shuffler'))
 def start_shuffler(port=DEFAULT_SHUFFLER_PORT,
@@ -119,7 +130,7 @@ def start_shuffler(port=DEFAULT_SHUFFLER_PORT,
     use_tls=False,
     tls_cert_file=LOCALHOST_TLS_CERT_FILE,
     tls_key_file=LOCALHOST_TLS_KEY_FILE,
-    verbose_count=0, wait=True):
+    verbose_count=0, wait=True, replace_process=False):
   """Starts the Shuffler.
 
   Args:
@@ -153,7 +164,7 @@ def start_shuffler(port=DEFAULT_SHUFFLER_PORT,
 
   print "Starting the shuffler..."
   print
-  return execute_command(cmd, wait)
+  return execute_command(cmd, wait, replace_process)
 
 ANALYZER_SERVICE_PATH = os.path.abspath(os.path.join(OUT_DIR, 'analyzer',
     'analyzer_service', 'analyzer_service'))
@@ -161,7 +172,7 @@ def start_analyzer_service(port=DEFAULT_ANALYZER_SERVICE_PORT,
     bigtable_project_name='', bigtable_instance_id='',
     private_key_pem_file=DEFAULT_ANALYZER_PRIVATE_KEY_PEM,
     verbose_count=0, vmodule=None,
-    wait=True):
+    wait=True, replace_process=False):
   print
   print "Starting the analyzer service..."
   print
@@ -183,7 +194,7 @@ def start_analyzer_service(port=DEFAULT_ANALYZER_SERVICE_PORT,
     cmd.append("-v=%d"%verbose_count)
   if vmodule:
     cmd.append("-vmodule=%s"%vmodule)
-  return execute_command(cmd, wait)
+  return execute_command(cmd, wait, replace_process)
 
 REPORT_MASTER_PATH = os.path.abspath(os.path.join(OUT_DIR, 'analyzer',
     'report_master', 'analyzer_report_master'))
@@ -194,7 +205,7 @@ def start_report_master(port=DEFAULT_REPORT_MASTER_PORT,
                         tls_cert_file=LOCALHOST_TLS_CERT_FILE,
                         tls_key_file=LOCALHOST_TLS_KEY_FILE,
                         verbose_count=0, vmodule=None,
-                        wait=True):
+                        wait=True, replace_process=False):
   print
   print "Starting the analyzer ReportMaster service..."
   print
@@ -220,7 +231,7 @@ def start_report_master(port=DEFAULT_REPORT_MASTER_PORT,
     cmd.append("-v=%d"%verbose_count)
   if vmodule:
     cmd.append("-vmodule=%s"%vmodule)
-  return execute_command(cmd, wait)
+  return execute_command(cmd, wait, replace_process)
 
 TEST_APP_PATH = os.path.abspath(os.path.join(OUT_DIR, 'tools', 'test_app',
                                 'cobalt_test_app'))
@@ -231,7 +242,7 @@ def start_test_app(shuffler_uri='', analyzer_uri='', use_tls=False,
                    cobalt_config_proto_path=CONFIG_BINARY_PROTO,
                    project_id=1,
                    automatic=False,
-                   verbose_count=0, wait=True):
+                   verbose_count=0, wait=True, replace_process=False):
   cmd = [TEST_APP_PATH,
       "-shuffler_uri", shuffler_uri,
       "-analyzer_uri", analyzer_uri,
@@ -249,13 +260,13 @@ def start_test_app(shuffler_uri='', analyzer_uri='', use_tls=False,
     cmd.append("-v=%d"%verbose_count)
   if automatic:
     cmd.append("-mode=automatic")
-  return execute_command(cmd, wait)
+  return execute_command(cmd, wait, replace_process)
 
 def start_report_client(report_master_uri='',
                         use_tls=False,
                         root_certs_pem_file=LOCALHOST_TLS_CERT_FILE,
                         project_id=1,
-                        verbose_count=0, wait=True):
+                        verbose_count=0, wait=True, replace_process=False):
   path = os.path.abspath(os.path.join(OUT_DIR, 'tools', 'report_client'))
   cmd = [path,
       "-report_master_uri", report_master_uri,
@@ -268,14 +279,14 @@ def start_report_client(report_master_uri='',
       cmd.append(root_certs_pem_file)
   if verbose_count > 0:
     cmd.append("-v=%d"%verbose_count)
-  return execute_command(cmd, wait)
+  return execute_command(cmd, wait, replace_process)
 
 OBSERVATION_QUERIER_PATH = os.path.abspath(os.path.join(OUT_DIR, 'tools',
                                            'observation_querier',
                                            'query_observations'))
 def start_observation_querier(bigtable_project_name='',
                               bigtable_instance_id='',
-                              verbose_count=0):
+                              verbose_count=0, replace_process=False):
   cmd = [OBSERVATION_QUERIER_PATH,
       "-logtostderr"]
   if not bigtable_project_name or not bigtable_instance_id:
@@ -285,5 +296,5 @@ def start_observation_querier(bigtable_project_name='',
                  "-bigtable_instance_id", bigtable_instance_id]
   if verbose_count > 0:
     cmd.append("-v=%d"%verbose_count)
-  return execute_command(cmd, wait=True)
+  return execute_command(cmd, wait=True, replace_process=replace_process)
 
@@ -52,7 +52,8 @@ def run_all_tests(test_dir,
                   bigtable_instance_id = '',
                   verbose_count=0,
                   vmodule=None,
-                  test_args=None):
+                  test_args=None,
+                  test_executables=None):
   """ Runs the tests in the given directory.
 
   Optionally also starts various processes that may be needed by the tests.
@@ -86,6 +87,9 @@ def run_all_tests(test_dir,
 
       test_args {list of strings} These will be passed to each test executable.
 
+      test_executables {list of strings} The names of the executables in
+      |test_dir| to run. If this is None then all of them are run.
+
     Returns: A list of strings indicating which tests failed. Returns None or
              to indicate success.
   """
@@ -106,7 +110,9 @@ def run_all_tests(test_dir,
   print "Running all tests in %s " % tdir
   print "Test arguments: '%s'" % test_args
   failure_list = []
-  for test_executable in os.listdir(tdir):
+  if test_executables is None:
+    test_executables = os.listdir(tdir)
+  for test_executable in test_executables:
     bt_emulator_process = None
     shuffler_process = None
     analyzer_service_process = None